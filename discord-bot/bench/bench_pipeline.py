@@ -0,0 +1,310 @@
+"""メモ処理パイプラインのオフラインベンチマーク
+
+DiscordとOpenAIを使わずに、フェイクのメッセージとフェイクのOpenAIサーバー
+（fake_openai.py）でwhisper_botのメモ処理をそのまま動かし、スループット・
+レイテンシ・import時間・インデックス読み込み時間・メモリ使用量を計測する。
+
+例:
+    python bench/bench_pipeline.py --notes 100,10000,100000 --memos 50 --latency 0.3
+    python bench/bench_pipeline.py --notes 1000 --memos 20 --json --max-p99 5.0
+
+Vaultサイズごとに別プロセスで実行する（設定は環境変数からimport時に読むため）。
+--max-p99を指定すると、p99レイテンシが超えた場合に終了コード1を返す。
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_openai import FakeOpenAI, SAMPLE_SENTENCES  # noqa: E402
+
+TOPICS = ["Python", "非同期処理", "Obsidian", "機械学習", "読書メモ", "散歩", "ビジネス", "TODO", "振り返り", "アイデア"]
+
+
+def generate_vault(path, count, seed=0):
+    """合成ノートを count 件作成する関数"""
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    for i in range(count):
+        topic = rnd.choice(TOPICS)
+        body = "".join(rnd.choice(SAMPLE_SENTENCES) for _ in range(rnd.randint(3, 12)))
+        with open(os.path.join(path, f"note_{i:06d}_{topic}.md"), "w", encoding="utf-8") as f:
+            f.write(f"# {topic} {i}\n\n{body}\n")
+
+
+def generate_wav(seconds, sample_rate=16000):
+    """無音と正弦波を交互に並べた合成WAVを返す関数"""
+    frames = bytearray()
+    for n in range(int(seconds * sample_rate)):
+        value = 0 if (n // sample_rate) % 3 == 2 else int(8000 * math.sin(2 * math.pi * 440 * n / sample_rate))
+        frames += struct.pack("<h", value)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+class FakeAuthor:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.name = "bench"
+
+
+class FakeAttachment:
+    def __init__(self, url, filename, size, content_type="audio/wav"):
+        self.url = url
+        self.filename = filename
+        self.size = size
+        self.content_type = content_type
+
+
+class FakeReply:
+    """message.reply() が返すメッセージ（編集回数だけ数える）"""
+
+    _ids = itertools.count(10**12)
+
+    def __init__(self, stats):
+        self.id = next(self._ids)
+        self.stats = stats
+
+    async def edit(self, **kwargs):
+        self.stats["edits"] += 1
+        return self
+
+
+class FakeMessage:
+    _ids = itertools.count(10**9)
+
+    def __init__(self, author, channel, content="", attachments=(), stats=None):
+        self.id = next(self._ids)
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.attachments = list(attachments)
+        self.stats = stats
+
+    async def reply(self, content=None, **kwargs):
+        self.stats["replies"] += 1
+        return FakeReply(self.stats)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_once(args, notes):
+    """1つのVaultサイズでベンチマークを実行し、結果のdictを返す関数"""
+    fake = FakeOpenAI(args.latency, args.whisper_latency, jitter=args.jitter, error_rate=args.error_rate, rpm=args.rpm)
+    runner, base_url = await fake.start()
+    workdir = tempfile.mkdtemp(prefix="bench-vault-")
+    vault = os.path.join(workdir, "vault")
+
+    started = time.perf_counter()
+    generate_vault(vault, notes)
+    generate_seconds = time.perf_counter() - started
+
+    voice_data = generate_wav(args.audio_seconds)
+    fake.files["voice.wav"] = voice_data
+
+    os.environ.update({
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "OBSIDIAN_VAULT_FOLDER_PATH": vault,
+        "ALLOWED_CHANNEL_IDS": "1",
+        "NOTE_INDEX_SNAPSHOT_PATH": os.path.join(workdir, "note_index.json"),
+        "NOTE_INDEX_REFRESH_INTERVAL": "0",
+        "MEMO_JOURNAL_PATH": os.path.join(workdir, "journal.sqlite3"),
+        "RESULT_CACHE_ENABLED": "false",
+        "PROGRESS_EDIT_INTERVAL": "0.2",
+        "MEMO_WORKERS": str(args.workers),
+        "MEMO_QUEUE_MAXSIZE": str(args.memos),
+        "MEMO_QUEUE_PER_USER": str(args.memos),
+        "METRICS_PORT": "0",
+        "DISCORD_CHANNEL_PER_MINUTE": str(args.discord_per_minute),
+        "DISCORD_CHANNEL_BURST": str(max(1.0, args.discord_per_minute / 12)),
+    })
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    from whisper_bot.app import get_bot
+    from whisper_bot.audio import close_http_session
+    from whisper_bot.metrics import metrics
+    from whisper_bot.openai_client import close_openai_client
+    import_seconds = time.perf_counter() - started
+    bot = get_bot()
+    shard = bot.shard_router.shards[0]
+
+    # インデックスの初回読み込み（スナップショットなし）
+    started = time.perf_counter()
+    await shard.note_index.ensure_loaded()
+    index_load_seconds = time.perf_counter() - started
+
+    latencies = []
+    done = asyncio.Event()
+    handler = shard.memo_pipeline.handler
+
+    async def timed_handler(job):
+        try:
+            await handler(job)
+        finally:
+            latencies.append(time.monotonic() - job.enqueued_at)
+            if len(latencies) >= args.memos:
+                done.set()
+
+    shard.memo_pipeline.handler = timed_handler
+    shard.memo_pipeline.start()
+
+    stats = {"replies": 0, "edits": 0}
+    channel = FakeChannel(1)
+    authors = [FakeAuthor(1000 + i) for i in range(args.users)]
+    rnd = random.Random(1)
+
+    started = time.perf_counter()
+    for i in range(args.memos):
+        author = authors[i % len(authors)]
+        if rnd.random() < args.voice_ratio:
+            attachment = FakeAttachment(f"{base_url}/files/voice.wav", f"voice_{i}.wav", len(voice_data))
+            message = FakeMessage(author, channel, attachments=[attachment], stats=stats)
+        else:
+            text = "".join(rnd.sample(SAMPLE_SENTENCES, 3))
+            message = FakeMessage(author, channel, content=text, stats=stats)
+        await bot.on_message(message)
+        if args.rate > 0:
+            await asyncio.sleep(1 / args.rate)
+
+    await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    wall_seconds = time.perf_counter() - started
+
+    traced_peak = None
+    if args.tracemalloc:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    await close_openai_client()
+    await close_http_session()
+    await runner.cleanup()
+
+    return {
+        "notes": notes,
+        "memos": args.memos,
+        "workers": args.workers,
+        "voice_ratio": args.voice_ratio,
+        "generate_vault_seconds": round(generate_seconds, 3),
+        "import_seconds": round(import_seconds, 3),
+        "index_load_seconds": round(index_load_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "memos_per_second": round(args.memos / wall_seconds, 3) if wall_seconds else None,
+        "latency_p50": round(percentile(latencies, 0.5), 3),
+        "latency_p99": round(percentile(latencies, 0.99), 3),
+        "latency_max": round(max(latencies), 3) if latencies else 0.0,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "tracemalloc_peak_mb": round(traced_peak / (1024 * 1024), 1) if traced_peak is not None else None,
+        "openai_requests": dict(fake.requests),
+        "openai_retries": metrics.counter_value("openai_retries_total"),
+        "openai_errors": metrics.counter_value("openai_errors_total"),
+        "discord_replies": stats["replies"],
+        "discord_edits": stats["edits"],
+    }
+
+
+def child_args(args, notes):
+    """子プロセスに渡す引数を組み立てる関数"""
+    argv = [sys.executable, os.path.abspath(__file__), "--child", "--notes", str(notes)]
+    for name in ("memos", "latency", "whisper_latency", "jitter", "error_rate", "rpm", "discord_per_minute", "voice_ratio",
+                 "audio_seconds", "workers", "users", "rate", "timeout"):
+        argv += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    if args.tracemalloc:
+        argv.append("--tracemalloc")
+    return argv
+
+
+def print_table(results):
+    header = (f"{'notes':>8} {'import(s)':>9} {'load(s)':>8} {'memo/s':>8} {'p50(s)':>8} {'p99(s)':>8}"
+              f" {'rss(MB)':>8}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['notes']:>8} {r['import_seconds']:>9.3f} {r['index_load_seconds']:>8.3f} {r['memos_per_second']:>8.2f} "
+              f"{r['latency_p50']:>8.3f} {r['latency_p99']:>8.3f} {r['max_rss_mb']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="メモ処理パイプラインのオフラインベンチマーク")
+    parser.add_argument("--notes", default="100,10000", help="Vaultのノート数（カンマ区切りで複数指定）")
+    parser.add_argument("--memos", type=int, default=30, help="投入するメモ数")
+    parser.add_argument("--latency", type=float, default=0.3, help="Chat APIの応答遅延（秒）")
+    parser.add_argument("--whisper-latency", type=float, default=0.5, help="Whisperの応答遅延（1MBあたり秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="遅延の揺らぎ（割合）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="APIがエラーを返す割合")
+    parser.add_argument("--rpm", type=int, default=0, help="フェイクAPIのRPM上限（0で無制限、超えると429）")
+    parser.add_argument("--discord-per-minute", type=float, default=6000,
+                        help="Discordへの送信ペース（件/分、実際のチャンネル制限に近づけるなら60）")
+    parser.add_argument("--voice-ratio", type=float, default=0.5, help="ボイスメモの割合")
+    parser.add_argument("--audio-seconds", type=float, default=10, help="合成音声の長さ（秒）")
+    parser.add_argument("--workers", type=int, default=3, help="MEMO_WORKERS")
+    parser.add_argument("--users", type=int, default=3, help="投稿ユーザー数")
+    parser.add_argument("--rate", type=float, default=0, help="投入レート（件/秒、0で一斉投入）")
+    parser.add_argument("--timeout", type=float, default=600, help="全メモ完了までの待ち時間上限（秒）")
+    parser.add_argument("--tracemalloc", action="store_true", help="tracemallocでPythonヒープのピークも計測する")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    parser.add_argument("--max-p99", type=float, default=None, help="p99レイテンシの上限（秒）。超えたら終了コード1")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = asyncio.run(run_once(args, int(args.notes)))
+        print("BENCH_RESULT " + json.dumps(result, ensure_ascii=False))
+        return
+
+    results = []
+    for notes in [int(n) for n in args.notes.split(",") if n.strip()]:
+        proc = subprocess.run(child_args(args, notes), capture_output=True, text=True)
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("BENCH_RESULT ")]
+        if proc.returncode != 0 or not lines:
+            sys.stderr.write(proc.stdout[-2000:] + proc.stderr[-4000:])
+            sys.exit(f"ノート数 {notes} のベンチマークに失敗しました")
+        results.append(json.loads(lines[-1][len("BENCH_RESULT "):]))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+
+    if args.max_p99 is not None:
+        worst = max(r["latency_p99"] for r in results)
+        if worst > args.max_p99:
+            print(f"p99レイテンシ {worst:.3f}s が上限 {args.max_p99:.3f}s を超えました", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
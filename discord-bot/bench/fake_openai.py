@@ -0,0 +1,215 @@
+"""ベンチマーク用のOpenAI互換フェイクサーバー
+
+Chat Completions（通常・ストリーミング・n指定）とWhisperの文字起こしに、
+設定した遅延で応答する。音声添付のダウンロード元（/files/...）も兼ねる。
+
+単体で起動する場合:
+    python bench/fake_openai.py --port 8800 --chat-latency 0.5 --whisper-latency 1.0
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import deque
+
+from aiohttp import web
+
+SAMPLE_SENTENCES = [
+    "今日はPythonの非同期処理について学んだ。",
+    "イベントループをブロックしないことが大事だと気づいた。",
+    "明日はObsidianのノート整理をする。",
+    "朝の散歩で新しいアイデアを思いついた。",
+    "機械学習の勉強を続けるためのTODOを整理した。",
+    "ビジネスの振り返りをしてタスクを洗い出した。",
+]
+
+
+class FakeOpenAI:
+    """遅延・エラー率・RPM上限を設定できるOpenAI互換のフェイクバックエンド"""
+
+    def __init__(self, chat_latency=0.3, whisper_latency=0.5, jitter=0.2, error_rate=0.0, seed=0, rpm=0):
+        self.chat_latency = chat_latency
+        self.whisper_latency = whisper_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.rpm = rpm
+        self.files = {}
+        self.requests = {"chat": 0, "whisper": 0, "files": 0, "errors": 0, "throttled": 0}
+        # エンドポイント -> 直近1分間の受付時刻
+        self._windows = {}
+
+    async def _sleep(self, base):
+        await asyncio.sleep(max(0.0, base * (1 + self.random.uniform(-self.jitter, self.jitter))))
+
+    def _should_fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.requests["errors"] += 1
+            return True
+        return False
+
+    def _throttle(self, endpoint):
+        """RPM上限を超えていれば429の応答を返す"""
+        if not self.rpm:
+            return None
+        window = self._windows.setdefault(endpoint, deque())
+        now = time.monotonic()
+        while window and now - window[0] > 60:
+            window.popleft()
+        if len(window) >= self.rpm:
+            self.requests["throttled"] += 1
+            retry_after = 60 - (now - window[0])
+            return web.json_response(
+                {"error": {"message": "fake rate limit", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429, headers={"retry-after": f"{retry_after:.2f}"},
+            )
+        window.append(now)
+        return None
+
+    def _completion_text(self, messages):
+        system = messages[0]["content"] if messages else ""
+        user = messages[-1]["content"] if messages else ""
+        if "関連性分析" in system and "JSON" in system:
+            # まとめて送られた各メモに候補から選んで返す
+            names = re.findall(r"^- ([^:]+):", user, re.MULTILINE)
+            memo_ids = re.findall(r"^\[(\d+)\]$", user, re.MULTILINE)
+            return json.dumps(
+                {i: self.random.sample(names, min(len(names), 2)) for i in memo_ids}, ensure_ascii=False
+            )
+        if "関連性分析" in system:
+            # 候補一覧からいくつか選んで返す
+            names = re.findall(r"^- ([^:]+):", user, re.MULTILINE)
+            picked = self.random.sample(names, min(len(names), 2)) if names else []
+            return ", ".join(picked) or "なし"
+        if "X（旧Twitter）" in system:
+            return "".join(self.random.sample(SAMPLE_SENTENCES, 2))[:130]
+        return "◆ 要約\n" + "\n".join(f"- {s}" for s in self.random.sample(SAMPLE_SENTENCES, 4))
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.requests["chat"] += 1
+        if (throttled := self._throttle("chat")) is not None:
+            return throttled
+        await self._sleep(self.chat_latency)
+        if self._should_fail():
+            return web.json_response({"error": {"message": "fake overload", "type": "server_error"}}, status=503)
+
+        messages = body.get("messages", [])
+        model = body.get("model", "gpt-4o-mini")
+        n = int(body.get("n") or 1)
+        created = int(time.time())
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages)
+
+        if body.get("stream"):
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            text = self._completion_text(messages)
+            for i in range(0, len(text), 8):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": text[i:i + 8]}, "finish_reason": None}],
+                }
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                await asyncio.sleep(0.005)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(text),
+                        "total_tokens": prompt_tokens + len(text),
+                    },
+                }
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            return response
+
+        choices = []
+        completion_tokens = 0
+        for i in range(n):
+            text = self._completion_text(messages)
+            completion_tokens += len(text)
+            choices.append({
+                "index": i,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            })
+        return web.json_response({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    async def transcriptions(self, request):
+        self.requests["whisper"] += 1
+        size = 0
+        reader = await request.multipart()
+        async for part in reader:
+            while chunk := await part.read_chunk():
+                size += len(chunk)
+        if (throttled := self._throttle("whisper")) is not None:
+            return throttled
+        # 音声サイズに比例した遅延（1MBあたりwhisper_latency秒、最低でもその1/4）
+        await self._sleep(self.whisper_latency * max(0.25, size / (1024 * 1024)))
+        if self._should_fail():
+            return web.json_response({"error": {"message": "fake overload", "type": "server_error"}}, status=503)
+        return web.json_response({"text": "".join(self.random.sample(SAMPLE_SENTENCES, 3))})
+
+    async def download(self, request):
+        self.requests["files"] += 1
+        data = self.files.get(request.match_info["name"])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data, content_type="audio/wav")
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/audio/transcriptions", self.transcriptions)
+        app.router.add_get("/files/{name}", self.download)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """サーバーを起動し、(runner, ベースURL) を返す"""
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        actual_port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://{host}:{actual_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI互換のフェイクサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--whisper-latency", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0, help="エンドポイントごとのRPM上限（0で無制限）")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.chat_latency, args.whisper_latency, error_rate=args.error_rate, rpm=args.rpm)
+    print(f"フェイクOpenAIサーバー: http://{args.host}:{args.port}/v1")
+    web.run_app(fake.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""長い音声の分割文字起こし（無音での分割・WAVのデコード・順番通りの連結）のテスト
+
+    cd discord-bot && python -m pytest -q tests
+"""
+import asyncio
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whisper_bot import audio  # noqa: E402
+
+RATE = 1000
+
+
+def tone(seconds):
+    t = np.arange(int(RATE * seconds))
+    return (8000 * np.sin(t * 0.3)).astype(np.int16)
+
+
+def silence(seconds):
+    return np.zeros(int(RATE * seconds), dtype=np.int16)
+
+
+def test_find_split_points_prefers_silence():
+    # 10秒ごとに区切るとき、8〜10秒の窓の中にある無音（8.5〜9秒）で分割する
+    samples = np.concatenate([tone(8.5), silence(0.5), tone(8.5), silence(0.5), tone(5)])
+    bounds = audio.find_split_points(samples, RATE, chunk_seconds=10, window_seconds=2)
+
+    assert bounds[0] == 0 and bounds[-1] == len(samples)
+    assert all(b - a <= 10 * RATE for a, b in zip(bounds, bounds[1:]))
+    assert 8.5 * RATE <= bounds[1] <= 9 * RATE
+    assert 17.5 * RATE <= bounds[2] <= 18 * RATE
+
+
+def test_find_split_points_without_silence_cuts_at_limit():
+    samples = tone(25)
+    bounds = audio.find_split_points(samples, RATE, chunk_seconds=10, window_seconds=2)
+
+    assert len(bounds) == 4
+    assert all(0 < b - a <= 10 * RATE for a, b in zip(bounds, bounds[1:]))
+
+
+def test_decode_wav_round_trip():
+    samples = tone(1.5)
+    decoded, rate = audio._decode_wav(audio.encode_wav(samples, RATE))
+
+    assert rate == RATE
+    assert np.array_equal(decoded, samples)
+
+
+def test_chunks_are_stitched_in_order_with_previous_context(monkeypatch):
+    prompts = {}
+
+    async def fake_transcription(**request):
+        name = request["file"][0]
+        i = int(name[len("chunk_"):-len(".wav")])
+        prompts[i] = request["prompt"]
+        # 後ろのチャンクほど早く終わることもある
+        await asyncio.sleep(random.uniform(0, 0.02))
+        return SimpleNamespace(text=f"text{i} ")
+
+    monkeypatch.setattr(audio, "create_transcription", fake_transcription)
+    monkeypatch.setattr(audio, "TRANSCRIBE_CHUNK_SECONDS", 1)
+    monkeypatch.setattr(audio, "TRANSCRIBE_SILENCE_WINDOW", 0.2)
+
+    samples = tone(8)
+    text = asyncio.run(audio.transcribe_in_chunks(samples, RATE, concurrency=2, model="whisper-1", prompt="語彙"))
+
+    n = len(audio.find_split_points(samples, RATE, 1, 0.2)) - 1
+    assert n > 4
+    assert text == "\n".join(f"text{i}" for i in range(n))
+    # 2本の列の先頭以外は、直前のチャンクの文字起こしを文脈に受け取る
+    for i in range(n):
+        if i in (0, n // 2):
+            assert prompts[i] == "語彙"
+        else:
+            assert prompts[i] == f"語彙\ntext{i - 1}"
@@ -0,0 +1,80 @@
+"""RelatedNotesBatcher のまとめ送信のテスト
+
+    cd discord-bot && python -m pytest -q tests
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whisper_bot import related  # noqa: E402
+
+
+def test_simultaneous_burst_is_batched(monkeypatch):
+    calls = []
+
+    async def fake_single(content, candidates, existing_notes):
+        calls.append([content])
+        await asyncio.sleep(0.05)
+        return [f"{content}-note"]
+
+    async def fake_batch(batch):
+        calls.append([content for content, _, _ in batch])
+        await asyncio.sleep(0.05)
+        return [[f"{content}-note"] for content, _, _ in batch]
+
+    monkeypatch.setattr(related, "analyze_related_notes", fake_single)
+    monkeypatch.setattr(related, "analyze_related_notes_batch", fake_batch)
+
+    async def burst():
+        batcher = related.RelatedNotesBatcher(window=0.01, max_size=8)
+        memos = [f"memo{i}" for i in range(6)]
+        results = await asyncio.gather(*(batcher.submit(memo, [], {}) for memo in memos))
+        return memos, results, batcher
+
+    memos, results, batcher = asyncio.run(burst())
+
+    # 最初の1件だけがすぐに送られ、残りの5件は1回のリクエストにまとまる
+    assert calls == [["memo0"], ["memo1", "memo2", "memo3", "memo4", "memo5"]]
+    assert results == [[f"{memo}-note"] for memo in memos]
+    assert batcher._inflight == 0
+
+
+def test_batch_uses_each_memos_own_headers(monkeypatch):
+    prompts = []
+
+    async def fake_completion(kind, **request):
+        prompts.append(request["messages"][1]["content"])
+        return '{"1": ["old"], "2": ["new"]}'
+
+    monkeypatch.setattr(related, "cached_chat_completion", fake_completion)
+    monkeypatch.setattr(related, "current_shard", lambda: type("Shard", (), {"chat_model": "m"})())
+
+    # 2件目のメモの時点では old が削除されている
+    batch = [
+        ("memo0", ["old"], {"old": "古いノート"}),
+        ("memo1", ["new"], {"new": "新しいノート"}),
+    ]
+    results = asyncio.run(related.analyze_related_notes_batch(batch))
+
+    assert results == [["old"], ["new"]]
+    assert "古いノート" in prompts[0] and "新しいノート" in prompts[0]
+
+
+def test_failed_batch_falls_back_to_single_requests(monkeypatch):
+    async def broken_batch(batch):
+        raise ValueError("not a JSON object")
+
+    async def fake_single(content, candidates, existing_notes):
+        await asyncio.sleep(0.05)
+        return [f"{content}-note"]
+
+    monkeypatch.setattr(related, "analyze_related_notes", fake_single)
+    monkeypatch.setattr(related, "analyze_related_notes_batch", broken_batch)
+
+    async def burst():
+        batcher = related.RelatedNotesBatcher(window=0.01, max_size=8)
+        return await asyncio.gather(*(batcher.submit(f"memo{i}", [], {}) for i in range(4)))
+
+    assert asyncio.run(burst()) == [[f"memo{i}-note"] for i in range(4)]
@@ -0,0 +1,17 @@
+"""Discordの音声・テキストメモを文字起こし・要約し、関連ノートのリンク付きでObsidianに保存するBot
+
+主なモジュール:
+    pipeline  メモ1件分の処理（文字起こし→要約/関連分析→SNS変換→保存）と処理キュー
+    index     Vaultのノートインデックスと候補検索
+    writer    ノートの保存
+    shards    チャンネル・Vaultごとの処理単位
+    app       Discord Bot本体
+    cli       ローカルのファイルをまとめて処理するオフライン実行
+
+各モジュールはimportしただけではDiscordやOpenAIに接続しない
+（OpenAIクライアント・Discord Bot・シャードは最初に使うときに作る）。
+"""
+import time
+
+# 起動時間の計測の基準（パッケージの読み込みを始めた時刻）
+IMPORT_STARTED = time.perf_counter()
@@ -0,0 +1,540 @@
+"""Discord Bot本体（メッセージの受付・ジョブの処理・起動時の再開と取り込み）"""
+import asyncio
+import datetime
+
+import discord
+from discord.ext import commands
+
+from .audio import (
+    AudioDownloadError,
+    close_http_session,
+    describe_audio_error,
+    is_audio_attachment,
+    transcribe_attachment,
+    transcribe_attachments,
+)
+from .config import (
+    CATCHUP_ENABLED,
+    DISCORD_BOT_TOKEN,
+    DISCORD_MESSAGE_LIMIT,
+    JOB_MAX_ATTEMPTS,
+    MULTI_AUDIO_MODE,
+    REGENERATE_COMMAND_RE,
+)
+from .index import load_note_index
+from .journal import JobCheckpoint
+from .metrics import StartupTimer, metrics, start_metrics_server, stop_metrics_server
+from .openai_client import close_openai_client, retryable_api_errors
+from .pipeline import CATCHUP_QUEUE_KEY, MemoJob, QueueFullError, process_memo
+from .progress import format_memo_result, split_discord_message
+from .runtime import current_shard, set_current_shard
+from .shards import get_shard_router
+from .summary import generate_sns_variants
+from .views import MemoResultView, SnsVariantView
+from .writer import NoteSaveError
+
+
+class WhisperBot(commands.Bot):
+    """メモの受付と共有リソースの後片付けを行うBot"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # シャードの振り分け（このプロセスが担当するシャードだけを作る）
+        self.shard_router = get_shard_router(handle_memo_job)
+        self.startup = StartupTimer()
+        # ゲートウェイに接続する直前の時刻のsnowflake（これより後の投稿はon_messageで受け取る）
+        self.connect_snowflake = None
+
+    async def setup_hook(self):
+        if self.connect_snowflake is None:
+            self.connect_snowflake = now_snowflake()
+
+    async def on_ready(self):
+        """Botがログインしたときに実行される処理（再接続のたびに呼ばれる）"""
+        print(f'{self.user} としてログインしました。')
+        first = "login" not in self.startup.phases
+        if first:
+            self.startup.mark("login")
+        await start_metrics_server()
+        for shard in self.shard_router.shards:
+            print(f'[{shard.name}] Obsidianの保存先: {shard.vault_path} / チャンネル: {sorted(shard.channel_ids)}')
+        # シャードごとに並行して読み込む（大きなVaultの読み込み中も他のシャードは処理できる）
+        await asyncio.gather(*(shard.start(recover=recover_shard) for shard in self.shard_router.shards))
+        if first:
+            self.startup.mark("index")
+            print(self.startup.summary())
+        print('---------------------------------')
+        print('ボイスメモの投稿を待っています...')
+
+    async def on_message(self, message):
+        """メッセージが投稿されたときに実行される処理"""
+        # Bot自身のメッセージは無視する
+        if message.author == self.user:
+            return
+    
+        # 設定されたチャンネル（またはサーバー）でのみ機能し、担当するシャードで処理する
+        shard = self.shard_router.route(message)
+        if shard is None:
+            return
+        set_current_shard(shard)
+        memo_pipeline = shard.memo_pipeline
+
+        # テキストメッセージに反応する機能を追加（デバッグ用）
+        if message.content.lower() == "ping":
+            await message.reply("pong! Botは正常に動作しています。")
+            return
+    
+        # チャンネル情報確認コマンド
+        if message.content.lower() == "channel_info":
+            await message.reply(f"チャンネル名: {message.channel.name}\nチャンネルID: {message.channel.id}")
+            return
+    
+        # 再生成コマンド（「再生成」「再生成 12」、またはBotの返信に対して「再生成」）
+        regenerate_match = REGENERATE_COMMAND_RE.match(message.content.strip())
+        if regenerate_match:
+            memo_id = regenerate_match.group(1)
+            await handle_regenerate_command(message, int(memo_id) if memo_id else None)
+            return
+    
+        # キュー状況確認コマンド
+        if message.content.lower() == "status":
+            positions = memo_pipeline.positions(message.author.id)
+            status_info = f"📊 **処理状況**\n\n**処理中**: {memo_pipeline.active} 件 / ワーカー {memo_pipeline.workers}\n"
+            status_info += f"**順番待ち**: {memo_pipeline.depth} 件（上限 {memo_pipeline.maxsize}）\n"
+            mine = memo_pipeline.active_jobs(message.author.id)
+            if mine:
+                status_info += f"\nあなたのメモ {mine} 件を処理中です。"
+            if positions:
+                status_info += f"\nあなたのメモの待ち順: {', '.join(f'{p}番目' for p in positions)}"
+            elif not mine:
+                status_info += "\nあなたの処理待ちメモはありません。"
+            await message.reply(status_info)
+            return
+    
+        # メトリクス確認コマンド
+        if message.content.lower() == "metrics":
+            await message.reply(metrics.summary_text())
+            return
+    
+        # デバッグコマンド：既存ノート一覧表示
+        if message.content.lower() == "debug":
+            note_index = await load_note_index()
+            names = note_index.names() if note_index is not None else []
+            debug_info = f"📋 **既存ノート確認**（{shard.name}）\n\n**読み込み済みノート数**: {len(names)}\n\n"
+            debug_info += "**ファイル一覧**:\n"
+            for filename in names[:10]:  # 最初の10件のみ表示
+                debug_info += f"- {filename}\n"
+            if len(names) > 10:
+                debug_info += f"... および他 {len(names) - 10} 件"
+            cache_stats = shard.result_cache.stats()
+            debug_info += f"\n\n**キャッシュ**: ヒット {cache_stats['hits']} / ミス {cache_stats['misses']}（{cache_stats['entries']} 件）"
+            await message.reply(debug_info)
+            return
+
+        # デバッグ情報を出力
+        print(f"メッセージを受信: {message.content}")
+        print(f"添付ファイル数: {len(message.attachments)}")
+    
+        if message.attachments:
+            for i, attachment in enumerate(message.attachments):
+                print(f"添付ファイル{i}: {attachment.filename}, タイプ: {attachment.content_type}")
+    
+        # テキストメモまたはボイスメモならキューに投入する
+        kind = classify_memo(message)
+        if kind is None:
+            return
+
+        # 同じメッセージを二重に処理しない（再開・取り込みと重なった場合など）
+        if not await claim_memo_job(shard, message, kind):
+            print(f"メッセージ {message.id} は処理済みまたは処理中です")
+            return
+
+        job = MemoJob(message, kind, shard)
+        try:
+            position = memo_pipeline.submit(job)
+        except QueueFullError as e:
+            await forget_memo_job(shard, message)
+            await message.reply(f"⏳ 現在混雑しているため受け付けできませんでした（{e}）。少し時間をおいて再投稿してください。")
+            return
+
+        # 以降の進捗はこの1つのメッセージを編集して伝える
+        label = "📝 テキストメモ" if kind == "text" else "🎙️ ボイスメモ"
+        if memo_pipeline.active + position > memo_pipeline.workers:
+            job.progress.set("status", f"{label}を受け付けました。順番待ち: {position} 番目（`status`で確認できます）")
+        else:
+            job.progress.set("status", f"{label}を処理中です...")
+        await job.progress.flush()
+
+    async def close(self):
+        """Bot終了時に共有HTTPクライアントも閉じる"""
+        try:
+            await close_openai_client()
+            await close_http_session()
+            await stop_metrics_server()
+            for shard in self.shard_router.shards:
+                shard.close()
+        finally:
+            await super().close()
+
+
+_bot = None
+
+
+def get_bot():
+    """Discord Botを返す関数（初回の呼び出し時に作る）"""
+    global _bot
+    if _bot is None:
+        # Discord BotのIntents設定
+        intents = discord.Intents.default()
+        intents.message_content = True
+        # discord.py 2.0以降ではcommands.Botを使用
+        _bot = WhisperBot(command_prefix='!', intents=intents)
+    return _bot
+
+
+async def handle_memo_job(job):
+    """キューから取り出したメモを処理する関数（ワーカーから呼ばれる）"""
+    # 以降のAPI呼び出し・保存・記録はこのジョブのシャードに対して行う
+    set_current_shard(job.shard)
+    message = job.message
+    progress = job.progress
+
+    # 再開したジョブなら保存済みのステージ出力から続ける
+    journal = job.shard.memo_journal
+    try:
+        await journal.start_job(message.id)
+        saved = await journal.job_stages(message.id)
+    except Exception as e:
+        print(f"ジャーナルの読み込みでエラー: {e}")
+        saved = {}
+
+    def checkpoint(part=0):
+        return JobCheckpoint(journal, message.id, part, saved.get(part))
+    if job.resumed:
+        done_stages = sorted({stage for stages in saved.values() for stage in stages})
+        print(f"メッセージ {message.id} の処理を再開します（保存済み: {', '.join(done_stages) or 'なし'}）")
+
+    if job.kind == "text":
+        try:
+            # テキストをそのまま使用
+            async def get_raw_text():
+                return message.content
+
+            progress.set("status", "📝 テキストメモを処理中です...")
+            progress.update()
+            result = await process_memo(get_raw_text, progress, checkpoint())
+            await record_memo_results(message, [result])
+            await send_memo_result([result], "✅ テキスト要約・関連性分析・SNS変換が完了し、Obsidianに保存しました。", progress)
+            await record_reply_message([result], progress)
+            await finish_memo_job(job, "done")
+
+        except Exception as e:
+            print(f"テキスト処理でエラーが発生しました: {e}")
+            await fail_memo_job(job, e, f"❌ テキスト処理中にエラーが発生しました: {e}")
+        return
+
+    attachments = [attachment for attachment in message.attachments if is_audio_attachment(attachment)]
+    # 一時的なエラーで失敗したクリップがあれば、ジョブを残して次回の起動時に再開する
+    # （保存済みのクリップは記録したステージ出力から同じノートを使う）
+    retry_later = False
+    try:
+        progress.set("status", f"🎙️ ボイスメモ {len(attachments)} 件を文字起こし中です...")
+        progress.update()
+        if MULTI_AUDIO_MODE == "separate" and len(attachments) > 1:
+            # 1クリップ = 1ノートとして、すべてのクリップを並行処理する
+            # （途中経過は件数のみ表示する）
+            completed = 0
+
+            async def process_clip(part, attachment):
+                nonlocal completed
+                try:
+                    return await process_memo(lambda: transcribe_attachment(attachment), checkpoint=checkpoint(part))
+                finally:
+                    completed += 1
+                    progress.set("status", f"🎙️ ボイスメモを処理中です... {completed}/{len(attachments)} 件完了")
+                    progress.update()
+
+            outcomes = await asyncio.gather(
+                *(process_clip(part, attachment) for part, attachment in enumerate(attachments)),
+                return_exceptions=True,
+            )
+            results = []
+            for attachment, outcome in zip(attachments, outcomes):
+                if isinstance(outcome, BaseException):
+                    print(f"{attachment.filename} の処理でエラーが発生しました: {outcome}")
+                    error = describe_audio_error(outcome)
+                    if is_retryable_error(outcome):
+                        error += RETRY_NOTICE
+                        retry_later = True
+                    results.append({"title": attachment.filename, "error": error})
+                else:
+                    outcome["title"] = attachment.filename
+                    results.append(outcome)
+        else:
+            # すべてのクリップを並行して文字起こしし、1つのノートにまとめる
+            # （文字起こしとノートインデックスの準備も並行して進む）
+            results = [await process_memo(lambda: transcribe_attachments(attachments), progress, checkpoint())]
+
+        await record_memo_results(message, results)
+        await send_memo_result(results, "✅ 文字起こし・要約・関連性分析・SNS変換が完了し、Obsidianに保存しました。", progress)
+        await record_reply_message(results, progress)
+        if not retry_later:
+            await finish_memo_job(job, "done")
+
+    except AudioDownloadError as e:
+        await finish_memo_job(job, "failed", str(e))
+        await progress.fail(describe_audio_error(e))
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        await fail_memo_job(job, e, f"❌ 処理中にエラーが発生しました: {e}")
+
+
+# ジョブを残して次回の起動時に再開するときに、エラーの返信に添える文
+RETRY_NOTICE = "\n♻️ 次回の起動時に再試行します。"
+
+
+def is_retryable_error(error):
+    """次回の起動時に再試行するエラーか（ノートの保存失敗・再試行しても解消しなかったAPIエラー）"""
+    return isinstance(error, (NoteSaveError, *retryable_api_errors()))
+
+
+async def fail_memo_job(job, error, text):
+    """ジョブの失敗を返信する関数（一時的なエラーならジョブを完了にせず、次回の起動時に再開する）"""
+    if is_retryable_error(error):
+        await job.progress.fail(text + RETRY_NOTICE)
+        return
+    await finish_memo_job(job, "failed", str(error))
+    await job.progress.fail(text)
+
+
+async def claim_memo_job(shard, message, kind):
+    """メッセージIDでジョブを登録する関数（登録済みならFalse。ジャーナルに書けなくても処理は続ける）"""
+    attachments = [
+        {"url": attachment.url, "filename": attachment.filename, "content_type": attachment.content_type}
+        for attachment in message.attachments
+    ]
+    try:
+        return await shard.memo_journal.claim_job(message.channel.id, message.id, kind, attachments)
+    except Exception as e:
+        print(f"ジャーナルへの記録でエラー: {e}")
+        return True
+
+
+async def forget_memo_job(shard, message):
+    try:
+        await shard.memo_journal.forget_job(message.id)
+    except Exception as e:
+        print(f"ジャーナルへの記録でエラー: {e}")
+
+
+async def finish_memo_job(job, status, error=None):
+    try:
+        await job.shard.memo_journal.finish_job(job.message.id, status, error)
+    except Exception as e:
+        print(f"ジャーナルへの記録でエラー: {e}")
+
+
+async def fetch_message(channel_id, message_id):
+    """チャンネルIDとメッセージIDからメッセージを取得し直す関数（添付ファイルのURLも新しくなる）"""
+    return await (await fetch_channel(channel_id)).fetch_message(message_id)
+
+
+async def fetch_channel(channel_id):
+    bot = get_bot()
+    return bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+
+
+def now_snowflake():
+    return discord.utils.time_snowflake(datetime.datetime.now(datetime.timezone.utc))
+
+
+async def recover_shard(shard):
+    """未完了ジョブの再開と、停止中に投稿されたメモの取り込みを順に行う
+
+    取り込みの起点（停止前に最後に受け付けたメッセージ）は、ジョブの再開で待たされている間に
+    ライブの投稿が記録されても動かないよう、接続前の時刻より前のIDに限って最初に読んでおく。
+    """
+    connected = get_bot().connect_snowflake or now_snowflake()
+    cursors = {}
+    if CATCHUP_ENABLED:
+        for channel_id in sorted(shard.channel_ids):
+            try:
+                cursors[channel_id] = await shard.memo_journal.last_message_id(channel_id, before=connected)
+            except Exception as e:
+                print(f"[{shard.name}] チャンネル {channel_id} の取り込み位置の読み込みでエラー: {e!r}")
+    # ここまでに投稿されたメッセージは履歴から取り込む（それ以降はon_messageで受け取る）
+    before = now_snowflake()
+    await resume_jobs(shard)
+    for channel_id, last_id in cursors.items():
+        try:
+            await catch_up(shard, channel_id, last_id, before)
+        except Exception as e:
+            print(f"[{shard.name}] チャンネル {channel_id} の取り込みでエラー: {e!r}")
+
+
+async def catch_up(shard, channel_id, last_id, before):
+    """last_idより後、beforeより前の履歴を最後までたどり、未処理のメモをキューに積む
+
+    途中で打ち切ると、次の起動では取り込み位置がライブの投稿まで進んで残りが取り込まれなくなるため、
+    件数では打ち切らない（履歴は100件ずつ取得し、キューに空きがなければ空くまで待つ）。
+    取り込むメモはまとめて1人分のユーザー枠（CATCHUP_QUEUE_KEY）で順番待ちするため、
+    ライブの投稿と交互に処理される。
+    """
+    if last_id is None:
+        # 初回起動では過去の履歴を取り込まない
+        return
+    channel = await fetch_channel(channel_id)
+    queued = 0
+    async for message in channel.history(limit=None, after=discord.Object(id=last_id),
+                                         before=discord.Object(id=before), oldest_first=True):
+        if message.author.bot:
+            continue
+        kind = classify_memo(message)
+        if kind is None or not await claim_memo_job(shard, message, kind):
+            continue
+        job = MemoJob(message, kind, shard, user_id=CATCHUP_QUEUE_KEY)
+        await shard.memo_pipeline.put(job)
+        queued += 1
+        metrics.inc("jobs_caught_up_total", shard=shard.name)
+    if queued:
+        print(f"[{shard.name}] 停止中に投稿されたメモ {queued} 件を取り込みました（チャンネル {channel_id}）")
+
+
+async def resume_jobs(shard):
+    """前回の起動で終わらなかったジョブを、メッセージを取得し直してキューに戻す"""
+    try:
+        jobs = await shard.memo_journal.unfinished_jobs()
+    except Exception as e:
+        print(f"[{shard.name}] 未完了ジョブの読み込みでエラー: {e}")
+        return
+    if jobs:
+        print(f"[{shard.name}] 未完了のジョブ {len(jobs)} 件を再開します")
+    for row in jobs:
+        message_id = row["message_id"]
+        if row["attempts"] >= JOB_MAX_ATTEMPTS:
+            print(f"[{shard.name}] メッセージ {message_id} は {row['attempts']} 回失敗したため再開しません")
+            await shard.memo_journal.finish_job(message_id, "failed", "再試行回数の上限に達しました")
+            continue
+        try:
+            message = await fetch_message(row["channel_id"], message_id)
+        except discord.NotFound:
+            await shard.memo_journal.finish_job(message_id, "failed", "メッセージが削除されました")
+            continue
+        except discord.HTTPException as e:
+            # 一時的なエラーなら次回の起動時に再開する
+            print(f"[{shard.name}] メッセージ {message_id} の取得でエラー: {e}")
+            continue
+        job = MemoJob(message, row["kind"], shard, resumed=True)
+        job.progress.set("status", "♻️ 再起動前に受け付けたメモの処理を再開します...")
+        await shard.memo_pipeline.put(job)
+        metrics.inc("jobs_resumed_total", shard=shard.name)
+
+
+# メモとして扱わないコマンド
+BOT_COMMANDS = ("ping", "channel_info", "再生成", "debug", "status", "metrics")
+
+
+def classify_memo(message):
+    """メッセージがテキストメモ（"text"）かボイスメモ（"voice"）かを返す関数（どちらでもなければNone）"""
+    content = message.content.strip()
+    if content and not message.attachments:
+        if content.lower() in BOT_COMMANDS or REGENERATE_COMMAND_RE.match(content):
+            return None
+        return "text"
+    if any(is_audio_attachment(attachment) for attachment in message.attachments):
+        return "voice"
+    return None
+
+
+async def send_memo_result(results, done_text, progress):
+    """パイプラインの結果で進捗メッセージを書き換える関数（長い場合のみ続きを返信する）"""
+    body = "\n\n".join(format_memo_result(result, done_text) for result in results)
+
+    # コピーボタンはSNS投稿用と元テキストを1つのViewにまとめる
+    copy_items = []
+    for i, result in enumerate(results, 1):
+        if "error" in result:
+            continue
+        suffix = f" {i}" if len(results) > 1 else ""
+        copy_items.append((f"SNS投稿{suffix}", result["sns"]))
+        copy_items.append((f"元テキスト{suffix}", result["raw_text"]))
+    view = MemoResultView(copy_items)
+
+    await progress.finish(split_discord_message(body), view)
+
+
+async def record_memo_results(message, results):
+    """パイプラインの結果をジャーナルに記録し、各結果にメモIDを付ける関数"""
+    for result in results:
+        if "error" in result:
+            continue
+        try:
+            result["memo_id"] = await current_shard().memo_journal.record_memo(
+                message.channel.id, message.id, result["save"], result["raw_text"], result["summary"], result["sns"]
+            )
+        except Exception as e:
+            print(f"ジャーナルへの記録でエラー: {e}")
+
+
+async def record_reply_message(results, progress):
+    """結果を表示した返信メッセージ（分けて送った続きも含む）のIDをジャーナルに記録する関数"""
+    memo_ids = [result["memo_id"] for result in results if "memo_id" in result]
+    reply_ids = [reply.id for reply in progress.result_messages]
+    if not memo_ids or not reply_ids:
+        return
+    try:
+        await current_shard().memo_journal.set_reply_messages(memo_ids, reply_ids)
+    except Exception as e:
+        print(f"ジャーナルへの記録でエラー: {e}")
+
+
+async def handle_regenerate_command(message, memo_id=None):
+    """SNS文章再生成コマンドを処理する関数
+
+    対象は「再生成 <メモID>」のID、返信先のメッセージ、最新のメモの順に決める
+    （IDや返信先を指定してメモが見つからなければ、別のメモにはしない）。
+    """
+    try:
+        memo_journal = current_shard().memo_journal
+        status = await message.reply("🔄 SNS文章を再生成中です...")
+        
+        # ジャーナルから対象のメモを取得（Vaultの走査は不要）
+        if memo_id is not None:
+            memo = await memo_journal.get(memo_id)
+            not_found = f"❌ メモID #{memo_id} のメモが見つかりません。"
+        elif message.reference and message.reference.message_id:
+            memo = await memo_journal.find_by_message(message.reference.message_id)
+            not_found = "❌ 返信先のメッセージに対応するメモが見つかりません。"
+        else:
+            memo = await memo_journal.latest(message.channel.id)
+            not_found = "❌ 再生成するメモが見つかりません。"
+        if memo is None:
+            await status.edit(content=not_found)
+            return
+        
+        # 1回のAPI呼び出しでSNS投稿の候補を複数生成
+        variants = await generate_sns_variants(memo["raw_text"])
+        if not variants:
+            await status.edit(content="❌ SNS文章を生成できませんでした。")
+            return
+        await memo_journal.add_variants(memo["id"], variants)
+        
+        # 結果を返信（ボタンで使う案を選ぶ）
+        reply_text = f"✅ **SNS文章の候補を {len(variants)} 件作成しました！**（メモID: #{memo['id']} / {memo['filename']}）\n"
+        for i, variant in enumerate(variants, 1):
+            reply_text += f"\n📱 **案{i}**（{len(variant)}文字）\n```\n{variant}\n```"
+        reply_text += "\nボタンで使う案を選んでください。"
+        await status.edit(content=reply_text[:DISCORD_MESSAGE_LIMIT], view=SnsVariantView(memo["id"], variants))
+        
+    except Exception as e:
+        await message.reply(f"❌ **SNS文章再生成エラー**\n\n詳細: {str(e)}")
+
+
+def main(started=None):
+    """Botを起動する関数（startedにimport前のtime.perf_counter()を渡すと、そこから起動時間を測る）"""
+    startup = StartupTimer(started) if started is not None else StartupTimer()
+    startup.mark("import")
+    bot = get_bot()
+    bot.startup = startup
+    startup.mark("init")
+    bot.run(DISCORD_BOT_TOKEN)
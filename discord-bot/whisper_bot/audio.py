@@ -0,0 +1,337 @@
+"""音声添付のダウンロードと文字起こし（長い音声は無音区間で分割して並行処理する）"""
+import asyncio
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+import wave
+
+import aiohttp
+import numpy as np
+
+from .cache import ResultCache
+from .config import (
+    AUDIO_DOWNLOAD_CHUNK_SIZE,
+    AUDIO_DOWNLOAD_MAX_CONNECTIONS,
+    AUDIO_DOWNLOAD_TIMEOUT,
+    AUDIO_SPOOL_MAX_MEMORY,
+    MAX_AUDIO_BYTES,
+    PCM_SAMPLE_RATE,
+    TRANSCRIBE_CHUNK_CONCURRENCY,
+    TRANSCRIBE_CHUNK_MIN_BYTES,
+    TRANSCRIBE_CHUNK_SECONDS,
+    TRANSCRIBE_CONTEXT_CHARS,
+    TRANSCRIBE_SILENCE_WINDOW,
+    WHISPER_PROMPT,
+)
+from .metrics import metrics
+from .openai_client import create_transcription
+from .runtime import current_shard
+
+
+async def cached_transcription(audio_digest, **request):
+    """Whisperの文字起こし結果をキャッシュ経由で取得する関数（音声はダイジェストでキー化）"""
+    params = {k: v for k, v in request.items() if k != "file"}
+    cache_key = ResultCache.make_key("transcription", audio_sha256=audio_digest, **params)
+    cached = await current_shard().result_cache.get(cache_key)
+    if cached is not None:
+        print("キャッシュヒット: transcription")
+        metrics.inc("cache_requests_total", kind="transcription", result="hit")
+        return cached
+    metrics.inc("cache_requests_total", kind="transcription", result="miss")
+    text = await transcribe_audio(**request)
+    await current_shard().result_cache.set(cache_key, text)
+    return text
+
+
+def is_audio_attachment(attachment):
+    """添付ファイルが音声かどうかを判定する関数"""
+    return bool(attachment.content_type) and attachment.content_type.startswith('audio/')
+
+
+def describe_audio_error(error):
+    """音声処理のエラーをユーザー向けのメッセージに変換する関数"""
+    if isinstance(error, AudioTooLargeError):
+        return f"❌ 音声ファイルが大きすぎます（上限 {MAX_AUDIO_BYTES // (1024 * 1024)}MB）。"
+    if isinstance(error, AudioDownloadError):
+        return "❌ 音声ファイルのダウンロードに失敗しました。"
+    return f"❌ 処理中にエラーが発生しました: {error}"
+
+
+async def transcribe_attachments(attachments):
+    """複数の音声を並行して文字起こしし、投稿順に連結する関数（失敗したクリップがあれば例外を送出する）"""
+    if len(attachments) == 1:
+        return await transcribe_attachment(attachments[0])
+
+    outcomes = await asyncio.gather(
+        *(transcribe_attachment(attachment) for attachment in attachments),
+        return_exceptions=True,
+    )
+    # 1つでも失敗したら、エラー文をノートに残さずメモ全体を失敗にする
+    # （成功したクリップはキャッシュされるため、再試行では失敗したものだけを文字起こしし直す）
+    for attachment, outcome in zip(attachments, outcomes):
+        if isinstance(outcome, BaseException):
+            print(f"{attachment.filename} の文字起こしでエラーが発生しました: {outcome}")
+            raise outcome
+
+    return "\n\n".join(
+        f"[{i}] {attachment.filename}\n{text}" for i, (attachment, text) in enumerate(zip(attachments, outcomes), 1)
+    )
+
+
+class AudioDownloadError(Exception):
+    """音声ファイルのダウンロードに失敗したことを表す例外"""
+
+
+class AudioTooLargeError(AudioDownloadError):
+    """音声ファイルがサイズ上限を超えていることを表す例外"""
+
+
+_http_session = None
+
+
+def get_http_session():
+    """添付ファイルのダウンロードに使う共有aiohttpセッションを返す関数"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=AUDIO_DOWNLOAD_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=AUDIO_DOWNLOAD_MAX_CONNECTIONS),
+        )
+    return _http_session
+
+
+async def close_http_session():
+    """作成済みなら共有aiohttpセッションを閉じる関数"""
+    if _http_session is not None:
+        await _http_session.close()
+
+
+def audio_upload_name(attachment):
+    """Whisperに渡すファイル名とMIMEタイプを添付ファイルの実際の形式から決める関数"""
+    content_type = (attachment.content_type or "audio/ogg").split(';')[0].strip()
+    filename = attachment.filename or ""
+    if not os.path.splitext(filename)[1]:
+        extension = mimetypes.guess_extension(content_type) or ".ogg"
+        filename = f"voice_memo{extension}"
+    return filename, content_type
+
+
+async def download_attachment(attachment):
+    """添付ファイルをチャンク単位でスプールファイルへ書き出し、(ファイル, SHA-256) を返す関数
+
+    サイズ上限はダウンロード前（Discordの申告サイズ・Content-Length）と
+    受信中の累計バイト数の両方でチェックする。
+    """
+    if attachment.size and attachment.size > MAX_AUDIO_BYTES:
+        raise AudioTooLargeError(f"{attachment.size} bytes")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=AUDIO_SPOOL_MAX_MEMORY)
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        async with get_http_session().get(attachment.url) as resp:
+            if resp.status != 200:
+                raise AudioDownloadError(f"HTTP {resp.status}")
+            if resp.content_length and resp.content_length > MAX_AUDIO_BYTES:
+                raise AudioTooLargeError(f"{resp.content_length} bytes")
+            async for chunk in resp.content.iter_chunked(AUDIO_DOWNLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                if received > MAX_AUDIO_BYTES:
+                    raise AudioTooLargeError(f"{received} bytes 以上")
+                digest.update(chunk)
+                spool.write(chunk)
+    except aiohttp.ClientError as e:
+        spool.close()
+        raise AudioDownloadError(str(e)) from e
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return spool, digest.hexdigest()
+
+
+async def transcribe_attachment(attachment):
+    """添付された音声ファイルをダウンロードしてWhisperで文字起こしする関数"""
+    # 音声ファイルをスプールファイルへストリーミングダウンロード
+    with metrics.timer("stage", stage="download"):
+        audio_file, audio_digest = await download_attachment(attachment)
+    metrics.inc("audio_download_bytes_total", audio_file.seek(0, os.SEEK_END))
+    audio_file.seek(0)
+    filename, content_type = audio_upload_name(attachment)
+
+    with audio_file:
+        return await transcribe_file(audio_file, audio_digest, filename, content_type)
+
+
+async def transcribe_file(audio_file, audio_digest, filename, content_type):
+    """音声ファイルをWhisperで文字起こしする関数（同じ音声ならキャッシュを返す）"""
+    return await cached_transcription(
+        audio_digest,
+        model=current_shard().whisper_model,
+        file=(filename, audio_file, content_type),
+        language="ja",
+        prompt=WHISPER_PROMPT,
+        temperature=0.0
+    )
+
+
+async def transcribe_audio(**request):
+    """音声を文字起こしする関数（長い音声は無音区間で分割して並行処理する）"""
+    _, audio_file, content_type = request["file"]
+    audio_file.seek(0, os.SEEK_END)
+    size = audio_file.tell()
+    audio_file.seek(0)
+
+    if size >= TRANSCRIBE_CHUNK_MIN_BYTES:
+        decoded = await decode_audio_to_pcm(audio_file, content_type)
+        if decoded is not None:
+            samples, rate = decoded
+            if len(samples) > rate * TRANSCRIBE_CHUNK_SECONDS:
+                return await transcribe_in_chunks(samples, rate, **request)
+
+    transcription = await create_transcription(**request)
+    return transcription.text
+
+
+async def transcribe_in_chunks(samples, rate, concurrency=TRANSCRIBE_CHUNK_CONCURRENCY, **request):
+    """PCM音声を無音区間で分割し、チャンクごとに文字起こしして順番通りに連結する関数
+
+    チャンクを連続した concurrency 本の列に分け、列どうしは並行に、列の中は順番に処理する。
+    列の中では直前のチャンクの末尾をpromptに渡して文脈をつなぐ（列の先頭のチャンクだけは文脈なし）。
+    """
+    bounds = await asyncio.to_thread(
+        find_split_points, samples, rate, TRANSCRIBE_CHUNK_SECONDS, TRANSCRIBE_SILENCE_WINDOW
+    )
+    texts = [None] * (len(bounds) - 1)
+    base_prompt = request.get("prompt", "")
+
+    async def transcribe_chunk(i):
+        prompt = base_prompt
+        if i > 0 and texts[i - 1]:
+            prompt = f"{base_prompt}\n{texts[i - 1][-TRANSCRIBE_CONTEXT_CHARS:]}"
+        chunk_file = await asyncio.to_thread(encode_wav, samples[bounds[i]:bounds[i + 1]], rate)
+        with chunk_file:
+            transcription = await create_transcription(
+                **{**request, "file": (f"chunk_{i:03d}.wav", chunk_file, "audio/wav"), "prompt": prompt}
+            )
+        texts[i] = transcription.text.strip()
+
+    async def transcribe_lane(indices):
+        for i in indices:
+            await transcribe_chunk(i)
+
+    start = time.perf_counter()
+    lanes = max(1, min(concurrency, len(texts)))
+    async with asyncio.TaskGroup() as group:
+        for lane in range(lanes):
+            group.create_task(transcribe_lane(range(
+                lane * len(texts) // lanes, (lane + 1) * len(texts) // lanes
+            )))
+    duration = len(samples) / rate
+    print(f"分割文字起こし: {len(texts)} チャンク / 音声 {duration:.0f}s / 所要 {time.perf_counter() - start:.2f}s")
+
+    return "\n".join(text for text in texts if text)
+
+
+def find_split_points(samples, rate, chunk_seconds, window_seconds, frame_seconds=0.03):
+    """各チャンクがchunk_seconds以内に収まるよう、直前window_secondsの中で最も静かな位置を分割点に選ぶ関数
+
+    戻り値は先頭0と末尾len(samples)を含むサンプル位置のリスト。
+    """
+    frame = max(1, int(rate * frame_seconds))
+    n_frames = len(samples) // frame
+    frames = samples[:n_frames * frame].astype(np.float32).reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(frames ** 2, axis=1))
+
+    target = int(rate * chunk_seconds)
+    window = min(int(rate * window_seconds), target - frame)
+    bounds = [0]
+    pos = 0
+    while len(samples) - pos > target:
+        lo = (pos + target - window) // frame
+        hi = max((pos + target) // frame, lo + 1)
+        split = (lo + int(np.argmin(energy[lo:hi]))) * frame
+        if split <= pos:
+            split = pos + target
+        bounds.append(split)
+        pos = split
+    bounds.append(len(samples))
+    return bounds
+
+
+def encode_wav(samples, rate):
+    """モノラル16bit PCMをWAV形式のスプールファイルに書き出す関数"""
+    spool = tempfile.SpooledTemporaryFile(max_size=AUDIO_SPOOL_MAX_MEMORY)
+    with wave.open(spool, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.astype('<i2').tobytes())
+    spool.seek(0)
+    return spool
+
+
+async def decode_audio_to_pcm(audio_file, content_type):
+    """音声をモノラル16bit PCM（NumPy配列, サンプルレート）にデコードする関数
+
+    WAVは標準ライブラリで読み、それ以外はffmpegがあれば使う。
+    デコードできない場合はNoneを返し、呼び出し側は分割せずに文字起こしする。
+    """
+    audio_file.seek(0)
+    try:
+        if content_type in ("audio/wav", "audio/x-wav", "audio/wave"):
+            return await asyncio.to_thread(_decode_wav, audio_file)
+        if shutil.which("ffmpeg") is None:
+            return None
+        return await _decode_with_ffmpeg(audio_file)
+    except Exception as e:
+        print(f"音声デコードでエラー（分割せずに処理します）: {e}")
+        return None
+    finally:
+        audio_file.seek(0)
+
+
+def _decode_wav(audio_file):
+    with wave.open(audio_file, 'rb') as w:
+        if w.getsampwidth() != 2:
+            return None
+        channels = w.getnchannels()
+        rate = w.getframerate()
+        frames = w.readframes(w.getnframes())
+    samples = np.frombuffer(frames, dtype='<i2')
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples, rate
+
+
+async def _decode_with_ffmpeg(audio_file):
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-ar", str(PCM_SAMPLE_RATE),
+        "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+
+    async def feed():
+        try:
+            while chunk := audio_file.read(AUDIO_DOWNLOAD_CHUNK_SIZE):
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            proc.stdin.close()
+
+    feeder = asyncio.create_task(feed())
+    pcm = await proc.stdout.read()
+    await feeder
+    if await proc.wait() != 0 or not pcm:
+        return None
+    return np.frombuffer(pcm, dtype='<i2'), PCM_SAMPLE_RATE
@@ -0,0 +1,184 @@
+"""Whisper/ChatGPTの結果のディスクキャッシュ"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .config import RESULT_CACHE_MAX_AGE, RESULT_CACHE_MAX_BYTES
+from .metrics import metrics
+from .openai_client import create_chat_completion, stream_chat_completion
+from .runtime import current_shard, run_blocking
+
+
+class ResultCache:
+    """入力のハッシュをキーにAPIの結果を保存するディスクキャッシュ
+
+    キーは (入力, モデル, プロンプト, temperature など) のSHA-256。
+    合計サイズと保持期間を超えたものは古い順（最終ヒット順）に削除する。
+    """
+
+    def __init__(self, cache_dir, max_bytes=RESULT_CACHE_MAX_BYTES, max_age=RESULT_CACHE_MAX_AGE, enabled=True,
+                 executor=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+        self.executor = executor
+        self.hits = 0
+        self.misses = 0
+        # key -> [size, 最終利用時刻]
+        self._index = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind, **params):
+        """結果に影響するパラメータからキャッシュキーを作る"""
+        payload = json.dumps({"kind": kind, **params}, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._index or ()),
+            "bytes": self._total_bytes,
+        }
+
+    async def get(self, key):
+        if not self.enabled:
+            return None
+        value = await run_blocking(self.executor, self._get, key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value):
+        if not self.enabled:
+            return
+        await run_blocking(self.executor, self._set, key, value)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    @staticmethod
+    def _is_bucket(name):
+        return len(name) == 2 and all(c in "0123456789abcdef" for c in name)
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        index = {}
+        total = 0
+        if os.path.isdir(self.cache_dir):
+            # キーの先頭2文字（16進数）のディレクトリだけを見る（他のシャードのキャッシュを数えない）
+            buckets = [name for name in os.listdir(self.cache_dir) if self._is_bucket(name)]
+            for bucket in buckets:
+                root = os.path.join(self.cache_dir, bucket)
+                try:
+                    files = os.listdir(root)
+                except OSError:
+                    continue
+                for name in files:
+                    if not name.endswith('.json'):
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    index[name[:-5]] = [stat.st_size, stat.st_mtime]
+                    total += stat.st_size
+        self._index = index
+        self._total_bytes = total
+
+    def _get(self, key):
+        path = self._path(key)
+        with self._lock:
+            self._ensure_index()
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[1] > self.max_age:
+                self._delete_locked(key)
+                return None
+            entry[1] = time.time()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)["value"]
+            # 最終利用時刻を更新（LRU的な削除順のため）
+            os.utime(path)
+            return value
+        except Exception as e:
+            print(f"キャッシュ読み込みエラー {key[:12]}: {e}")
+            with self._lock:
+                self._delete_locked(key)
+            return None
+
+    def _set(self, key, value):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"created": time.time(), "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            print(f"キャッシュ書き込みエラー {key[:12]}: {e}")
+            return
+        with self._lock:
+            self._ensure_index()
+            old = self._index.get(key)
+            if old:
+                self._total_bytes -= old[0]
+            self._index[key] = [size, time.time()]
+            self._total_bytes += size
+            self._evict_locked()
+
+    def _evict_locked(self):
+        now = time.time()
+        for key in [k for k, (_, used) in self._index.items() if now - used > self.max_age]:
+            self._delete_locked(key)
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._delete_locked(key)
+
+    def _delete_locked(self, key):
+        entry = self._index.pop(key, None)
+        if entry:
+            self._total_bytes -= entry[0]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+async def cached_chat_completion(kind, on_delta=None, **request):
+    """Chat Completionsの応答本文をキャッシュ経由で取得する関数
+
+    on_deltaを渡すとストリーミングで受信し、途中経過をon_deltaに通知する。
+    """
+    cache_key = ResultCache.make_key(kind, **request)
+    cached = await current_shard().result_cache.get(cache_key)
+    if cached is not None:
+        print(f"キャッシュヒット: {kind}")
+        metrics.inc("cache_requests_total", kind=kind, result="hit")
+        if on_delta:
+            on_delta(cached)
+        return cached
+    metrics.inc("cache_requests_total", kind=kind, result="miss")
+    if on_delta:
+        content = await stream_chat_completion(on_delta, kind=kind, **request)
+    else:
+        response = await create_chat_completion(kind=kind, **request)
+        content = response.choices[0].message.content
+    await current_shard().result_cache.set(cache_key, content)
+    return content
@@ -0,0 +1,171 @@
+"""ローカルの音声・テキストファイルをDiscordを使わずにまとめて処理するオフライン実行
+
+Botと同じパイプライン（文字起こし→要約/関連分析→SNS変換→保存）を通し、ノートをVaultに保存する。
+OpenAIのレート制限・再試行・キャッシュもBotと同じものを使う。
+
+    python -m whisper_bot.cli memos/*.m4a notes/ --jobs 4
+    python -m whisper_bot.cli memo.txt --vault /path/to/vault --json
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+import time
+
+from .config import MEMO_WORKERS
+from .metrics import StartupTimer
+from .openai_client import close_openai_client
+from .pipeline import process_memo
+from .runtime import run_blocking, set_current_shard
+from .shards import Shard, load_shard_configs
+
+# テキストメモとして読み込む拡張子
+TEXT_EXTENSIONS = (".txt", ".md")
+
+
+def classify_path(path):
+    """ファイルがテキストメモ（"text"）か音声（"voice"）かを返す関数（どちらでもなければNone）"""
+    if path.lower().endswith(TEXT_EXTENSIONS):
+        return "text"
+    content_type = mimetypes.guess_type(path)[0] or ""
+    if content_type.startswith("audio/") or path.lower().endswith((".m4a", ".ogg", ".opus")):
+        return "voice"
+    return None
+
+
+def collect_files(paths):
+    """引数のファイルとディレクトリ（直下のファイル）から処理対象を名前順に集める関数"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            entries = sorted(os.path.join(path, name) for name in os.listdir(path))
+            files.extend(entry for entry in entries if os.path.isfile(entry) and classify_path(entry))
+        elif classify_path(path):
+            files.append(path)
+        else:
+            print(f"対応していない形式のためスキップします: {path}", file=sys.stderr)
+    return files
+
+
+def _read_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def transcribe_path(shard, path):
+    """ローカルの音声ファイルを文字起こしする関数"""
+    # 音声まわり（aiohttpなど）は音声ファイルがあるときだけ読み込む
+    from .audio import transcribe_file
+
+    digest = await run_blocking(shard.executor, _file_digest, path)
+    content_type = mimetypes.guess_type(path)[0] or "audio/ogg"
+    with open(path, 'rb') as audio_file:
+        return await transcribe_file(audio_file, digest, os.path.basename(path), content_type)
+
+
+async def process_file(shard, path):
+    """ファイル1件をパイプラインに通し、結果をまとめたdictを返す関数"""
+    set_current_shard(shard)
+    start = time.perf_counter()
+    if classify_path(path) == "text":
+        async def get_raw_text():
+            return await run_blocking(shard.executor, _read_text, path)
+    else:
+        async def get_raw_text():
+            return await transcribe_path(shard, path)
+    try:
+        result = await process_memo(get_raw_text)
+    except Exception as e:
+        return {"path": path, "error": str(e), "seconds": time.perf_counter() - start}
+    return {
+        "path": path,
+        "note": result["save"],
+        "related": result["related"],
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def make_shard(name=None, vault=None):
+    """設定（SHARDS_CONFIG_PATHまたは環境変数）からシャードを作る関数（vaultを渡すとその保存先で作る）"""
+    if vault:
+        return Shard.from_config({"name": name or "cli", "vault": vault})
+    configs = load_shard_configs()
+    if name is not None:
+        configs = [entry for entry in configs if entry["name"] == name]
+        if not configs:
+            raise SystemExit(f"シャード {name} が見つかりません")
+    return Shard.from_config(configs[0])
+
+
+async def run(args, startup, output=None):
+    """ファイルを処理して終了コードを返す関数（--jsonの結果はoutputに書く）"""
+    output = output or sys.stdout
+    files = collect_files(args.paths)
+    if not files:
+        print("処理するファイルがありません", file=sys.stderr)
+        return 1
+
+    shard = make_shard(args.shard, args.vault)
+    await shard.note_index.ensure_loaded()
+    startup.mark("index")
+    print(f"{startup.summary()} / 既存ノート {len(shard.note_index)} 件", file=sys.stderr)
+
+    # 同時に処理するファイル数を制限する（API呼び出しはBotと同じレート制限に従う）
+    semaphore = asyncio.Semaphore(args.jobs)
+
+    async def bounded(path):
+        async with semaphore:
+            outcome = await process_file(shard, path)
+        if not args.json:
+            if "error" in outcome:
+                print(f"❌ {path}: {outcome['error']}")
+            else:
+                print(f"✅ {path} -> {outcome['note']}（{outcome['seconds']:.2f}s）")
+        return outcome
+
+    start = time.perf_counter()
+    try:
+        outcomes = await asyncio.gather(*(bounded(path) for path in files))
+    finally:
+        await close_openai_client()
+        shard.close()
+    elapsed = time.perf_counter() - start
+
+    failed = sum(1 for outcome in outcomes if "error" in outcome)
+    if args.json:
+        print(json.dumps(outcomes, ensure_ascii=False, indent=2), file=output)
+    print(f"{len(files)} 件を {elapsed:.2f}s で処理しました（失敗 {failed} 件 / {len(files) / elapsed:.2f} 件/秒）",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    startup = StartupTimer()
+    startup.mark("import")
+    parser = argparse.ArgumentParser(description="ローカルの音声・テキストファイルをまとめてObsidianに保存する")
+    parser.add_argument("paths", nargs="+", help="音声・テキスト（.txt/.md）ファイル、またはそれらを含むディレクトリ")
+    parser.add_argument("--vault", help="保存先のVault（省略時は設定のシャードのVault）")
+    parser.add_argument("--shard", help="SHARDS_CONFIG_PATHのシャード名（省略時は最初のシャード）")
+    parser.add_argument("--jobs", type=int, default=MEMO_WORKERS, help="同時に処理するファイル数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args(argv)
+    # --jsonのときは、パイプラインのログを標準エラーに回して標準出力をJSONだけにする
+    output = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext():
+        return asyncio.run(run(args, startup, output))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""環境変数（.env）から読み込む設定"""
+import os
+import re
+import tempfile
+
+from dotenv import load_dotenv
+
+
+# .envファイルから環境変数を読み込む
+load_dotenv()
+
+# --- 設定読み込み ---
+DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OBSIDIAN_VAULT_FOLDER_PATH = os.getenv("OBSIDIAN_VAULT_FOLDER_PATH", "/tmp/obsidian")
+# Botが使うデータ（ジャーナル・インデックスのスナップショット）の保存先
+# （Vaultの中に置くと同期ツールがSQLiteのファイルを途中の状態で同期・上書きして壊すことがあるため、Vaultの外に置く）
+BOT_DATA_DIR = os.path.expanduser(os.getenv("BOT_DATA_DIR", "~/.discord-whisper-bot"))
+
+# Botが反応するチャンネル（カンマ区切り。SHARDS_CONFIG_PATHを指定した場合はそちらの設定を使う）
+ALLOWED_CHANNEL_IDS = [int(x) for x in os.getenv("ALLOWED_CHANNEL_IDS", "1070657253050421353").split(",") if x.strip()]
+
+# 使用するモデル（シャードごとに上書きできる）
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "whisper-1")
+
+# チャンネル/サーバーごとにVaultを分けるシャード設定（JSON）と、複数プロセスへの割り当て
+SHARDS_CONFIG_PATH = os.getenv("SHARDS_CONFIG_PATH")
+SHARD_PROCESS_INDEX = int(os.getenv("SHARD_PROCESS_INDEX", "0"))
+SHARD_PROCESS_COUNT = int(os.getenv("SHARD_PROCESS_COUNT", "1"))
+# シャードごとのVault読み書き用スレッド数（巨大なVaultの読み込みが他のシャードを待たせない）
+SHARD_VAULT_THREADS = int(os.getenv("SHARD_VAULT_THREADS", "2"))
+
+# OpenAI API呼び出しのタイムアウト（秒）と同時実行数の上限
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "8"))
+WHISPER_MAX_CONCURRENCY = int(os.getenv("WHISPER_MAX_CONCURRENCY", "4"))
+
+# OpenAIのレート制限（1分あたりのリクエスト数・トークン数）と再試行の設定
+CHAT_RPM = int(os.getenv("CHAT_RPM", "500"))
+CHAT_TPM = int(os.getenv("CHAT_TPM", "200000"))
+WHISPER_RPM = int(os.getenv("WHISPER_RPM", "50"))
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "60"))
+OPENAI_RETRY_DEADLINE = float(os.getenv("OPENAI_RETRY_DEADLINE", "120"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+
+# Discordへの送信・編集のペース（チャンネルごと。Discordの制限は概ね5秒に5回）
+DISCORD_CHANNEL_PER_MINUTE = float(os.getenv("DISCORD_CHANNEL_PER_MINUTE", "60"))
+DISCORD_CHANNEL_BURST = float(os.getenv("DISCORD_CHANNEL_BURST", "5"))
+
+# ノートインデックスの設定（ヘッダー文字数・スナップショット保存先・再同期間隔）
+NOTE_HEADER_CHARS = int(os.getenv("NOTE_HEADER_CHARS", "500"))
+NOTE_INDEX_SNAPSHOT_PATH = os.path.expanduser(os.getenv(
+    "NOTE_INDEX_SNAPSHOT_PATH", os.path.join(BOT_DATA_DIR, "default", "note_index.json")
+))
+NOTE_INDEX_REFRESH_INTERVAL = float(os.getenv("NOTE_INDEX_REFRESH_INTERVAL", "300"))
+
+# ノート保存時のfsync（none: しない / each: 毎回 / batch: ディレクトリのfsyncをまとめる）
+NOTE_FSYNC_MODE = os.getenv("NOTE_FSYNC_MODE", "batch")
+NOTE_FSYNC_BATCH_WINDOW = float(os.getenv("NOTE_FSYNC_BATCH_WINDOW", "0.2"))
+
+# 処理済みメモのジャーナル（再生成コマンドが参照する）
+MEMO_JOURNAL_PATH = os.path.expanduser(
+    os.getenv("MEMO_JOURNAL_PATH", os.path.join(BOT_DATA_DIR, "default", "memo_journal.sqlite3"))
+)
+REGENERATE_COMMAND_RE = re.compile(r'^再生成(?:\s*#?(\d+))?$')
+# 再起動をまたいで再開するジョブの試行回数の上限（超えたら失敗として扱う）
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# 起動時に、停止中に投稿されたメモを取り込むかどうか（取り込むときは停止中の投稿をすべてたどる）
+CATCHUP_ENABLED = os.getenv("CATCHUP_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# SNS投稿の文字数上限と、再生成で一度に作る候補数
+SNS_MAX_CHARS = 140
+REGENERATE_VARIANTS = int(os.getenv("REGENERATE_VARIANTS", "4"))
+REGENERATE_TEMPERATURE = float(os.getenv("REGENERATE_TEMPERATURE", "0.9"))
+
+# 関連ノート検索の設定（BM25で絞り込む候補数・LLMを使うかどうか）
+RELATED_CANDIDATE_K = int(os.getenv("RELATED_CANDIDATE_K", "20"))
+RELATED_NOTES_USE_LLM = os.getenv("RELATED_NOTES_USE_LLM", "true").lower() in ("1", "true", "yes")
+RELATED_NOTES_MAX = int(os.getenv("RELATED_NOTES_MAX", "5"))
+# 混雑時に関連ノート分析をまとめるメモ数の上限（1で無効）と、まとめる待ち時間（秒）
+RELATED_BATCH_MAX = int(os.getenv("RELATED_BATCH_MAX", "8"))
+RELATED_BATCH_WINDOW = float(os.getenv("RELATED_BATCH_WINDOW", "0.3"))
+
+# API結果キャッシュの設定（保存先・最大サイズ・保持期間）
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "discord-whisper-bot-cache"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+RESULT_CACHE_MAX_AGE = float(os.getenv("RESULT_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+
+# 音声ダウンロードの設定（サイズ上限・メモリに保持する上限・チャンクサイズ）
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(25 * 1024 * 1024)))
+AUDIO_SPOOL_MAX_MEMORY = int(os.getenv("AUDIO_SPOOL_MAX_MEMORY", str(1024 * 1024)))
+AUDIO_DOWNLOAD_CHUNK_SIZE = int(os.getenv("AUDIO_DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+AUDIO_DOWNLOAD_TIMEOUT = float(os.getenv("AUDIO_DOWNLOAD_TIMEOUT", "120"))
+AUDIO_DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("AUDIO_DOWNLOAD_MAX_CONNECTIONS", "10"))
+
+# 文字起こしの設定（長い音声を分割するしきい値・チャンク長・並行数）
+WHISPER_PROMPT = "音声メモ、思考メモ、アイデア、学び、気づき、Twitter投稿、SNS、プログラミング、技術、ビジネス、日常の振り返り、TODO、タスク、メモ"
+TRANSCRIBE_CHUNK_MIN_BYTES = int(os.getenv("TRANSCRIBE_CHUNK_MIN_BYTES", str(2 * 1024 * 1024)))
+TRANSCRIBE_CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "300"))
+TRANSCRIBE_SILENCE_WINDOW = float(os.getenv("TRANSCRIBE_SILENCE_WINDOW", "20"))
+TRANSCRIBE_CHUNK_CONCURRENCY = int(os.getenv("TRANSCRIBE_CHUNK_CONCURRENCY", "4"))
+TRANSCRIBE_CONTEXT_CHARS = 100
+PCM_SAMPLE_RATE = 16000
+
+# 複数の音声が添付されたときの扱い（merge: 1つのノートにまとめる / separate: クリップごとにノートを作る）
+MULTI_AUDIO_MODE = os.getenv("MULTI_AUDIO_MODE", "merge")
+
+# Discordの1メッセージあたりの文字数上限
+DISCORD_MESSAGE_LIMIT = 2000
+
+# 進捗メッセージを編集する最小間隔（秒）
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "1.5"))
+
+# メモ処理キューの設定（ワーカー数・キュー上限・ユーザーごとの上限）
+MEMO_WORKERS = int(os.getenv("MEMO_WORKERS", "3"))
+MEMO_QUEUE_MAXSIZE = int(os.getenv("MEMO_QUEUE_MAXSIZE", "50"))
+MEMO_QUEUE_PER_USER = int(os.getenv("MEMO_QUEUE_PER_USER", "10"))
+
+# メトリクスのHTTPエンドポイント（0で無効）とChatGPTの料金（USD / 100万トークン）
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+CHAT_PRICE_PROMPT = float(os.getenv("CHAT_PRICE_PROMPT", "0.15"))
+CHAT_PRICE_COMPLETION = float(os.getenv("CHAT_PRICE_COMPLETION", "0.60"))
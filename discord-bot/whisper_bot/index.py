@@ -0,0 +1,317 @@
+"""Vaultのノートインデックスと、日本語bi-gram + BM25による候補検索"""
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from .config import NOTE_HEADER_CHARS, NOTE_INDEX_REFRESH_INTERVAL, RELATED_CANDIDATE_K
+from .runtime import current_shard, run_blocking
+
+
+_ASCII_WORD_RE = re.compile(r'[a-z0-9]+')
+_JA_RUN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+')
+
+
+def tokenize_for_search(text):
+    """日本語は文字bi-gram、英数字は単語単位でトークン化する関数"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = _ASCII_WORD_RE.findall(text)
+    for run in _JA_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class LexicalIndex:
+    """BM25による転置インデックス（スコア計算はNumPyでベクトル化）"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._names = []
+        self._ids = {}
+        self._doc_len = []
+        self._doc_terms = []
+        self._doc_alive = []
+        # term -> {doc_id: tf}
+        self._postings = {}
+        # term -> (doc_ids, tfs) のNumPy配列キャッシュ
+        self._posting_arrays = {}
+        self._doc_len_array = None
+        self._total_len = 0
+        self._alive = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._alive
+
+    def add(self, name, text):
+        """ドキュメントを追加（既存なら置き換え）する"""
+        counts = Counter(tokenize_for_search(text))
+        with self._lock:
+            self._remove_locked(name)
+            doc_id = self._ids.get(name)
+            if doc_id is None:
+                doc_id = len(self._names)
+                self._ids[name] = doc_id
+                self._names.append(name)
+                self._doc_len.append(0)
+                self._doc_terms.append(())
+                self._doc_alive.append(False)
+            length = sum(counts.values())
+            self._doc_len[doc_id] = length
+            self._doc_terms[doc_id] = tuple(counts)
+            self._doc_alive[doc_id] = True
+            self._total_len += length
+            self._alive += 1
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+                self._posting_arrays.pop(term, None)
+            self._doc_len_array = None
+
+    def remove(self, name):
+        with self._lock:
+            self._remove_locked(name)
+
+    def _remove_locked(self, name):
+        doc_id = self._ids.get(name)
+        if doc_id is None or not self._doc_alive[doc_id]:
+            return
+        for term in self._doc_terms[doc_id]:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+            self._posting_arrays.pop(term, None)
+        self._total_len -= self._doc_len[doc_id]
+        self._doc_len[doc_id] = 0
+        self._doc_terms[doc_id] = ()
+        self._doc_alive[doc_id] = False
+        self._alive -= 1
+        self._doc_len_array = None
+
+    def search(self, query, k=10):
+        """クエリとの類似度が高い上位k件を (name, score) のリストで返す"""
+        # NumPyの読み込みには時間がかかるため、最初の検索まで遅らせる（起動とインデックスの読み込みには不要）
+        import numpy as np
+
+        query_terms = set(tokenize_for_search(query))
+        with self._lock:
+            if not self._alive or not query_terms:
+                return []
+            if self._doc_len_array is None:
+                self._doc_len_array = np.asarray(self._doc_len, dtype=np.float32)
+            doc_len = self._doc_len_array
+            avgdl = max(self._total_len / self._alive, 1.0)
+            norm = self.k1 * (1 - self.b + self.b * doc_len / avgdl)
+            scores = np.zeros(len(self._names), dtype=np.float32)
+            for term in query_terms:
+                arrays = self._posting_arrays.get(term)
+                if arrays is None:
+                    posting = self._postings.get(term)
+                    if not posting:
+                        continue
+                    arrays = (
+                        np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                        np.fromiter(posting.values(), dtype=np.float32, count=len(posting)),
+                    )
+                    self._posting_arrays[term] = arrays
+                ids, tfs = arrays
+                df = len(ids)
+                idf = math.log(1 + (self._alive - df + 0.5) / (df + 0.5))
+                scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm[ids])
+            names = self._names
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(names[i], float(scores[i])) for i in top if scores[i] > 0]
+
+
+class NoteIndex:
+    """Vault内ノートのヘッダーをメモリ上に保持するインデックス
+
+    起動時に一度だけ（またはスナップショットから）読み込み、以降は
+    NoteWriterからの通知とmtime/sizeの差分チェックで更新する。
+    """
+
+    def __init__(self, folder_path, snapshot_path=None, header_chars=NOTE_HEADER_CHARS, executor=None):
+        self.folder_path = folder_path
+        self.snapshot_path = snapshot_path
+        self.header_chars = header_chars
+        self.executor = executor
+        # ファイル名（拡張子なし） -> {"mtime_ns", "size", "header"}
+        self._entries = {}
+        self._headers = {}
+        # 関連ノート候補の絞り込みに使う転置インデックス
+        self.lexical = LexicalIndex()
+        self._lock = threading.Lock()
+        self._load_lock = asyncio.Lock()
+        self._loaded = False
+        self._refresh_task = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def __len__(self):
+        return len(self._entries)
+
+    def headers(self, names):
+        """指定したノートのヘッダーを返す（ファイル名 -> ヘッダー文字列。インデックスにないものは含めない）
+
+        Vaultのスレッドから更新されるため、ロック内で必要な分だけをコピーして渡す。
+        """
+        with self._lock:
+            return {name: self._headers[name] for name in names if name in self._headers}
+
+    def names(self):
+        """インデックス済みのノート名の一覧を返す"""
+        with self._lock:
+            return list(self._headers)
+
+    def search(self, query, k=RELATED_CANDIDATE_K):
+        """クエリに近いノートを (ファイル名, スコア) で上位k件返す"""
+        return self.lexical.search(query, k)
+
+    async def ensure_loaded(self):
+        """未読み込みであればスナップショットとVaultからインデックスを構築する"""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            await run_blocking(self.executor, self._load)
+            self._loaded = True
+
+    async def refresh(self):
+        """mtime/sizeが変化したノートだけを読み直す"""
+        await run_blocking(self.executor, self._sync)
+
+    def start_refresh_loop(self, interval=NOTE_INDEX_REFRESH_INTERVAL):
+        """外部エディタでの変更を拾うための定期再同期タスクを開始する"""
+        if self._refresh_task is None and interval > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(interval))
+
+    async def _refresh_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"ノートインデックスの再同期でエラー: {e}")
+
+    def update_note(self, filename, content, full_path):
+        """保存直後のノートをインデックスへ反映する（再スキャン不要）"""
+        try:
+            stat = os.stat(full_path)
+        except OSError as e:
+            print(f"ノートインデックス更新エラー {filename}: {e}")
+            return
+        name = filename[:-3] if filename.endswith('.md') else filename
+        entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "header": content[:self.header_chars]}
+        with self._lock:
+            self._entries[name] = entry
+            self._headers[name] = entry["header"]
+        self.lexical.add(name, entry["header"])
+
+    def _load(self):
+        self._load_snapshot()
+        self._sync()
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("header_chars") != self.header_chars:
+                return
+            entries = data.get("entries", {})
+            with self._lock:
+                self._entries = entries
+                self._headers = {name: entry["header"] for name, entry in entries.items()}
+            for name, entry in entries.items():
+                self.lexical.add(name, entry["header"])
+            print(f"ノートインデックスのスナップショットを読み込みました: {len(entries)} 件")
+        except Exception as e:
+            print(f"スナップショット読み込みエラー: {e}")
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            with self._lock:
+                data = {"header_chars": self.header_chars, "entries": dict(self._entries)}
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            print(f"スナップショット保存エラー: {e}")
+
+    def _read_header(self, file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            # 必要なヘッダー部分だけを読む
+            return f.read(self.header_chars)
+
+    def _sync(self):
+        if not os.path.isdir(self.folder_path):
+            return
+        with self._lock:
+            current = dict(self._entries)
+        seen = set()
+        changed = {}
+        with os.scandir(self.folder_path) as it:
+            for dir_entry in it:
+                if not dir_entry.name.endswith('.md') or not dir_entry.is_file():
+                    continue
+                name = dir_entry.name[:-3]
+                seen.add(name)
+                try:
+                    stat = dir_entry.stat()
+                    old = current.get(name)
+                    if old and old["mtime_ns"] == stat.st_mtime_ns and old["size"] == stat.st_size:
+                        continue
+                    header = self._read_header(dir_entry.path)
+                except Exception as e:
+                    print(f"ファイル読み込みエラー {dir_entry.name}: {e}")
+                    continue
+                changed[name] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "header": header}
+        removed = [name for name in current if name not in seen]
+        with self._lock:
+            for name in removed:
+                self._entries.pop(name, None)
+                self._headers.pop(name, None)
+            for name, entry in changed.items():
+                self._entries[name] = entry
+                self._headers[name] = entry["header"]
+        for name in removed:
+            self.lexical.remove(name)
+        for name, entry in changed.items():
+            self.lexical.add(name, entry["header"])
+        if changed or removed:
+            print(f"ノートインデックス更新: 変更 {len(changed)} 件 / 削除 {len(removed)} 件（合計 {len(self._entries)} 件）")
+            self._save_snapshot()
+
+
+async def load_note_index():
+    """処理中のシャードのノートインデックスを、読み込みを済ませてから返す関数（読み込めなければNone）"""
+    try:
+        note_index = current_shard().note_index
+        await note_index.ensure_loaded()
+        return note_index
+    except Exception as e:
+        print(f"既存ノート読み込みでエラー: {e}")
+        return None
@@ -0,0 +1,291 @@
+"""処理済みメモと処理中のジョブを記録するSQLiteのジャーナル"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .runtime import run_blocking
+
+
+class MemoJournal:
+    """処理したメモを記録するSQLiteのジャーナル
+
+    メモID・元テキスト・要約・SNS投稿（再生成した候補もすべて）を保存し、
+    再生成コマンドがVaultを走査せずに対象のメモを引けるようにする。
+    処理中のジョブ（DiscordのメッセージID単位）とステージごとの出力も保存し、
+    再起動後に途中から再開できるようにする。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS memos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            channel_id INTEGER,
+            message_id INTEGER,
+            reply_message_id INTEGER,
+            filename TEXT,
+            raw_text TEXT NOT NULL,
+            summary TEXT,
+            sns_post TEXT
+        );
+        CREATE INDEX IF NOT EXISTS memos_message_id ON memos (message_id);
+        CREATE INDEX IF NOT EXISTS memos_reply_message_id ON memos (reply_message_id);
+        CREATE TABLE IF NOT EXISTS memo_replies (
+            message_id INTEGER NOT NULL,
+            memo_id INTEGER NOT NULL REFERENCES memos (id),
+            PRIMARY KEY (message_id, memo_id)
+        );
+        CREATE TABLE IF NOT EXISTS sns_variants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            memo_id INTEGER NOT NULL REFERENCES memos (id),
+            created_at REAL NOT NULL,
+            text TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sns_variants_memo_id ON sns_variants (memo_id);
+        CREATE TABLE IF NOT EXISTS jobs (
+            message_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            attachments TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+        CREATE TABLE IF NOT EXISTS job_stages (
+            message_id INTEGER NOT NULL,
+            part INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (message_id, part, stage)
+        );
+    """
+
+    def __init__(self, path, executor=None):
+        self.path = path
+        self.executor = executor
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func, *args):
+        def call():
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    return func(conn, *args)
+        return await run_blocking(self.executor, call)
+
+    async def record_memo(self, channel_id, message_id, filename, raw_text, summary, sns_post):
+        """処理したメモを記録し、メモIDを返す（再開したジョブで記録済みなら既存のIDを返す）"""
+        def insert(conn):
+            row = conn.execute(
+                "SELECT id FROM memos WHERE message_id = ? AND filename = ?", (message_id, filename)
+            ).fetchone()
+            if row:
+                return row["id"]
+            now = time.time()
+            cursor = conn.execute(
+                "INSERT INTO memos (created_at, channel_id, message_id, filename, raw_text, summary, sns_post)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (now, channel_id, message_id, filename, raw_text, summary, sns_post),
+            )
+            if sns_post:
+                conn.execute(
+                    "INSERT INTO sns_variants (memo_id, created_at, text) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, now, sns_post),
+                )
+            return cursor.lastrowid
+        return await self._run(insert)
+
+    async def set_reply_messages(self, memo_ids, reply_message_ids):
+        """Botの返信メッセージID（長い結果を分けて送ったものもすべて）を記録する（返信からメモを引けるようにする）"""
+        def update(conn):
+            conn.executemany(
+                "UPDATE memos SET reply_message_id = ? WHERE id = ?",
+                [(reply_message_ids[0], memo_id) for memo_id in memo_ids],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO memo_replies (message_id, memo_id) VALUES (?, ?)",
+                [(reply_message_id, memo_id) for reply_message_id in reply_message_ids for memo_id in memo_ids],
+            )
+        await self._run(update)
+
+    async def latest(self, channel_id=None):
+        """最新のメモを返す（主キーの降順で1件だけ読む）"""
+        def query(conn):
+            if channel_id is None:
+                row = conn.execute("SELECT * FROM memos ORDER BY id DESC LIMIT 1").fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT * FROM memos WHERE channel_id = ? ORDER BY id DESC LIMIT 1", (channel_id,)
+                ).fetchone()
+            return dict(row) if row else None
+        return await self._run(query)
+
+    async def get(self, memo_id):
+        def query(conn):
+            row = conn.execute("SELECT * FROM memos WHERE id = ?", (memo_id,)).fetchone()
+            return dict(row) if row else None
+        return await self._run(query)
+
+    async def find_by_message(self, message_id):
+        """投稿またはBotの返信のメッセージIDからメモを探す"""
+        def query(conn):
+            row = conn.execute(
+                "SELECT * FROM memos WHERE message_id = ? OR reply_message_id = ?"
+                " OR id IN (SELECT memo_id FROM memo_replies WHERE message_id = ?) ORDER BY id DESC LIMIT 1",
+                (message_id, message_id, message_id),
+            ).fetchone()
+            return dict(row) if row else None
+        return await self._run(query)
+
+    async def add_variants(self, memo_id, texts):
+        """再生成したSNS投稿の候補を追記する"""
+        def insert(conn):
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO sns_variants (memo_id, created_at, text) VALUES (?, ?, ?)",
+                [(memo_id, now, text) for text in texts],
+            )
+        await self._run(insert)
+
+    async def select_variant(self, memo_id, text):
+        """選ばれたSNS投稿をメモの採用案として記録する"""
+        def update(conn):
+            conn.execute("UPDATE memos SET sns_post = ? WHERE id = ?", (text, memo_id))
+        await self._run(update)
+
+    async def claim_job(self, channel_id, message_id, kind, attachments=()):
+        """メッセージのジョブを登録する（同じメッセージのジョブが既にあればFalse）"""
+        def insert(conn):
+            now = time.time()
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (message_id, channel_id, kind, status, attachments, created_at, updated_at)"
+                " VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (message_id, channel_id, kind, json.dumps(list(attachments), ensure_ascii=False), now, now),
+            )
+            return cursor.rowcount == 1
+        return await self._run(insert)
+
+    async def forget_job(self, message_id):
+        """受け付けなかったジョブを削除する（再投稿や取り込みで受け付け直せるように）"""
+        def delete(conn):
+            conn.execute("DELETE FROM jobs WHERE message_id = ?", (message_id,))
+            conn.execute("DELETE FROM job_stages WHERE message_id = ?", (message_id,))
+        await self._run(delete)
+
+    async def start_job(self, message_id):
+        """ジョブを処理中にして試行回数を数える"""
+        def update(conn):
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE message_id = ?",
+                (time.time(), message_id),
+            )
+        await self._run(update)
+
+    async def finish_job(self, message_id, status, error=None):
+        """ジョブを完了（done）または失敗（failed）にし、途中経過を消す"""
+        def update(conn):
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE message_id = ?",
+                (status, error, time.time(), message_id),
+            )
+            conn.execute("DELETE FROM job_stages WHERE message_id = ?", (message_id,))
+        await self._run(update)
+
+    async def unfinished_jobs(self):
+        """前回の起動で終わらなかったジョブを投稿順に返す"""
+        def query(conn):
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY message_id"
+            ).fetchall()
+            return [dict(row) for row in rows]
+        return await self._run(query)
+
+    async def last_message_id(self, channel_id, before=None):
+        """チャンネルで最後に受け付けたメッセージのID（beforeがあればそれより前のIDに限る。記録がなければNone）"""
+        def query(conn):
+            bound = before if before is not None else 2 ** 63 - 1
+            row = conn.execute(
+                "SELECT MAX(id) AS id FROM ("
+                " SELECT MAX(message_id) AS id FROM jobs WHERE channel_id = ? AND message_id < ?"
+                " UNION ALL SELECT MAX(message_id) FROM memos WHERE channel_id = ? AND message_id < ?)",
+                (channel_id, bound, channel_id, bound),
+            ).fetchone()
+            return row["id"]
+        return await self._run(query)
+
+    async def save_stage(self, message_id, part, stage, value):
+        """ステージの出力を保存する"""
+        def insert(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO job_stages (message_id, part, stage, value) VALUES (?, ?, ?, ?)",
+                (message_id, part, stage, json.dumps(value, ensure_ascii=False)),
+            )
+        await self._run(insert)
+
+    async def job_stages(self, message_id):
+        """保存済みのステージ出力を {パート: {ステージ名: 値}} で返す"""
+        def query(conn):
+            rows = conn.execute(
+                "SELECT part, stage, value FROM job_stages WHERE message_id = ?", (message_id,)
+            ).fetchall()
+            stages = {}
+            for row in rows:
+                stages.setdefault(row["part"], {})[row["stage"]] = json.loads(row["value"])
+            return stages
+        return await self._run(query)
+
+
+class JobCheckpoint:
+    """ジョブ1パート分（ノート1件分）のステージ出力をジャーナルに保存し、再開時に再利用するクラス"""
+
+    # 保存するステージ（ノート一覧は再開時に読み直す）
+    STAGES = ("raw_text", "summary", "related", "sns", "save_plan", "save")
+
+    def __init__(self, journal, message_id, part=0, saved=None):
+        self.journal = journal
+        self.message_id = message_id
+        self.part = part
+        self.saved = dict(saved or {})
+
+    async def store(self, stage, value):
+        self.saved[stage] = value
+        try:
+            await self.journal.save_stage(self.message_id, self.part, stage, value)
+        except Exception as e:
+            print(f"ジャーナルへの記録でエラー: {e}")
+
+    def wrap(self, stages):
+        """保存済みのステージは出力を再利用し、それ以外は実行後に保存するようにする"""
+        wrapped = dict(stages)
+        for name in self.STAGES:
+            if name not in stages:
+                continue
+            deps, func = stages[name]
+
+            async def run(results, name=name, func=func):
+                if name in self.saved:
+                    return self.saved[name]
+                value = await func(results)
+                if value is not None:
+                    await self.store(name, value)
+                return value
+
+            wrapped[name] = (deps, run)
+        return wrapped
@@ -0,0 +1,214 @@
+"""処理時間・トークン数・キューの状況などのメトリクス（Prometheus形式でも公開できる）"""
+import bisect
+import contextlib
+import time
+from collections import deque
+
+from . import IMPORT_STARTED
+from .config import (
+    CHAT_PRICE_COMPLETION,
+    CHAT_PRICE_PROMPT,
+    DISCORD_MESSAGE_LIMIT,
+    METRICS_HOST,
+    METRICS_PORT,
+)
+
+
+# --------------------
+
+# 処理時間ヒストグラムのバケット（秒）
+METRIC_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, float("inf"))
+
+
+class Histogram:
+    """Prometheus形式のバケットと、直近の値（パーセンタイル表示用）を保持するヒストグラム"""
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=512)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Metrics:
+    """各ステージの処理時間・トークン数・キャッシュ・キューの状況を集計するクラス"""
+
+    PREFIX = "whisperbot_"
+
+    def __init__(self):
+        # (名前, ラベルのタプル) -> 値
+        self.counters = {}
+        self.histograms = {}
+        # (名前, ラベルのタプル) -> 値を返す関数（キューの深さなど、参照時に読む値）
+        self.gauges = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name, func, **labels):
+        self.gauges[self._key(name, labels)] = func
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """ブロックの所要時間を記録し、例外が出たらエラー数も数える"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    def record_usage(self, model, usage):
+        """OpenAI APIのトークン使用量を記録する"""
+        if usage is None:
+            return
+        self.inc("openai_tokens_total", usage.prompt_tokens or 0, model=model, type="prompt")
+        self.inc("openai_tokens_total", usage.completion_tokens or 0, model=model, type="completion")
+
+    def counter_value(self, name, **labels):
+        return sum(
+            value for (n, key_labels), value in self.counters.items()
+            if n == name and all(item in key_labels for item in labels.items())
+        )
+
+    def estimated_cost(self):
+        """トークン数からChatGPTの概算コスト（USD）を出す"""
+        prompt = self.counter_value("openai_tokens_total", type="prompt")
+        completion = self.counter_value("openai_tokens_total", type="completion")
+        return (prompt * CHAT_PRICE_PROMPT + completion * CHAT_PRICE_COMPLETION) / 1_000_000
+
+    def render_prometheus(self):
+        """Prometheusのテキスト形式で出力する"""
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{self.PREFIX}{name}{fmt_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.PREFIX}{name}_bucket{fmt_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.PREFIX}{name}_sum{fmt_labels(labels)} {histogram.sum}")
+            lines.append(f"{self.PREFIX}{name}_count{fmt_labels(labels)} {histogram.count}")
+        for (name, labels), func in sorted(self.gauges.items(), key=lambda item: item[0]):
+            try:
+                lines.append(f"{self.PREFIX}{name}{fmt_labels(labels)} {func()}")
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+    def summary_text(self):
+        """metricsコマンド用の要約を作る"""
+        text = "📈 **メトリクス**\n"
+        uptime = time.time() - self.started_at
+        text += f"稼働時間: {uptime / 3600:.1f} 時間\n\n**処理時間**（件数 / p50 / p95 / 平均 / エラー）\n"
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            if not name.endswith("_seconds") or not histogram.count:
+                continue
+            label = " ".join(f"{v}" for _, v in labels) or name
+            errors = self.counter_value(name[:-len("_seconds")] + "_errors_total", **dict(labels))
+            text += (
+                f"- {name[:-len('_seconds')]} {label}: {histogram.count} / {histogram.percentile(0.5):.2f}s"
+                f" / {histogram.percentile(0.95):.2f}s / {histogram.sum / histogram.count:.2f}s / {errors}\n"
+            )
+        prompt = self.counter_value("openai_tokens_total", type="prompt")
+        completion = self.counter_value("openai_tokens_total", type="completion")
+        text += f"\n**トークン**: 入力 {prompt} / 出力 {completion}（概算 ${self.estimated_cost():.4f}）\n"
+        for (name, labels), func in sorted(self.gauges.items(), key=lambda item: item[0]):
+            label = "".join(f" {v}" for _, v in labels)
+            try:
+                text += f"**{name}**{label}: {func()}\n"
+            except Exception:
+                continue
+        return text[:DISCORD_MESSAGE_LIMIT]
+
+
+# プロセス全体で共有するメトリクス
+metrics = Metrics()
+
+
+class StartupTimer:
+    """起動の各段階（import・ログイン・インデックス読み込みなど）の所要時間を記録するクラス"""
+
+    def __init__(self, started=IMPORT_STARTED):
+        self.started = started
+        # 段階名 -> 所要時間（秒）
+        self.phases = {}
+        self._last = self.started
+
+    def mark(self, phase):
+        """直前の段階からここまでをphaseの所要時間として記録する"""
+        now = time.perf_counter()
+        seconds = self.phases[phase] = now - self._last
+        self._last = now
+        metrics.gauge("startup_seconds", lambda: round(seconds, 3), phase=phase)
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def summary(self):
+        phases = " / ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items())
+        return f"起動時間: 合計 {self.total:.2f}s（{phases}）"
+
+
+_metrics_runner = None
+
+
+async def start_metrics_server():
+    """Prometheus形式のメトリクスを返すHTTPサーバーを起動する関数（METRICS_PORT=0なら何もしない）"""
+    global _metrics_runner
+    if not METRICS_PORT or _metrics_runner is not None:
+        return
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    _metrics_runner = web.AppRunner(app)
+    await _metrics_runner.setup()
+    await web.TCPSite(_metrics_runner, METRICS_HOST, METRICS_PORT).start()
+    print(f'メトリクスを http://{METRICS_HOST}:{METRICS_PORT}/metrics で公開しています')
+
+
+async def stop_metrics_server():
+    global _metrics_runner
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
@@ -0,0 +1,220 @@
+"""OpenAI APIの呼び出し（レート制限・再試行込み）
+
+openai/httpxの読み込みには時間がかかるため、最初のAPI呼び出しまで遅らせる。
+"""
+import asyncio
+import functools
+import random
+import time
+from types import SimpleNamespace
+
+from .config import (
+    CHAT_MAX_CONCURRENCY,
+    CHAT_RPM,
+    CHAT_TPM,
+    OPENAI_API_KEY,
+    OPENAI_BACKOFF_BASE,
+    OPENAI_BACKOFF_MAX,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_RETRIES,
+    OPENAI_RETRY_DEADLINE,
+    OPENAI_TIMEOUT,
+    WHISPER_MAX_CONCURRENCY,
+    WHISPER_RPM,
+)
+from .metrics import metrics
+from .ratelimit import EndpointLimiter
+from .runtime import current_shard
+
+
+@functools.cache
+def retryable_api_errors():
+    """再試行する一時的なエラー（接続エラー・タイムアウト・429・5xx）"""
+    import openai
+    return openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError
+
+
+class RetryScheduler:
+    """レート制限の待機・ジッター付き指数バックオフ・期限付きの再試行をまとめて行うクラス"""
+
+    def __init__(self, max_retries=OPENAI_MAX_RETRIES, deadline=OPENAI_RETRY_DEADLINE,
+                 base_delay=OPENAI_BACKOFF_BASE, max_delay=OPENAI_BACKOFF_MAX):
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt, retry_after=None):
+        """attempt回目の待ち時間（full jitter。Retry-Afterがあればそれ以上待つ）"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def retry_after(error):
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        try:
+            return float(response.headers.get("retry-after") or 0) or None
+        except ValueError:
+            return None
+
+    async def call(self, limiter, func, tokens=0, deadline=None):
+        """limiterの予算内でfunc()を呼び、一時的なエラーなら期限内で再試行する"""
+        deadline_at = time.monotonic() + (self.deadline if deadline is None else deadline)
+        attempt = 0
+        while True:
+            await limiter.acquire(tokens)
+            try:
+                async with limiter.semaphore:
+                    result = await func()
+            except retryable_api_errors() as e:
+                if getattr(e, "status_code", None) == 429:
+                    # 利用枠の上限切れは待っても回復しない
+                    if e.code == "insufficient_quota":
+                        raise
+                    limiter.on_throttled()
+                delay = self.backoff(attempt, self.retry_after(e))
+                if attempt >= self.max_retries or time.monotonic() + delay > deadline_at:
+                    raise
+                attempt += 1
+                metrics.inc("openai_retries_total", endpoint=limiter.name, error=type(e).__name__)
+                print(f"{limiter.name} APIを{delay:.1f}秒後に再試行します（{attempt}/{self.max_retries}）: {e}")
+                await asyncio.sleep(delay)
+                continue
+            limiter.on_success()
+            usage = getattr(result, "usage", None)
+            if limiter.tokens is not None and tokens and usage is not None:
+                limiter.tokens.adjust(tokens - usage.total_tokens)
+            return result
+
+
+def estimate_chat_tokens(request):
+    """Chat Completionsの消費トークン数を見積もる（日本語は概ね1文字1トークン）"""
+    prompt = sum(len(m.get("content") or "") for m in request.get("messages", []))
+    return prompt + request.get("max_tokens", 500) * request.get("n", 1)
+
+
+_openai_client = None
+
+
+def get_openai_client():
+    """OpenAIクライアントを返す関数（初回の呼び出し時に共有コネクションプールとともに作る）"""
+    global _openai_client
+    if _openai_client is None:
+        import httpx
+        from openai import AsyncOpenAI
+
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+            ),
+            follow_redirects=True,
+        )
+        _openai_client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            # 再試行はRetrySchedulerでレート制限と合わせて行う
+            max_retries=0,
+            http_client=http_client,
+        )
+    return _openai_client
+
+
+async def close_openai_client():
+    """作成済みならOpenAIクライアントを閉じる関数"""
+    global _openai_client
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+
+# API種別ごとのレート制限・同時実行数と、共有の再試行スケジューラ
+# （APIキー単位の上限なので全シャードで共有し、シャードごとの同時実行数は別に持つ）
+chat_limiter = EndpointLimiter("chat", CHAT_RPM, CHAT_TPM, CHAT_MAX_CONCURRENCY)
+whisper_limiter = EndpointLimiter("whisper", WHISPER_RPM, None, WHISPER_MAX_CONCURRENCY)
+api_scheduler = RetryScheduler()
+
+
+async def create_chat_completion(kind="chat", **kwargs):
+    """レート制限と再試行を管理しつつChat Completions APIを呼び出す関数"""
+    async def attempt():
+        with metrics.timer("openai", endpoint="chat", kind=kind):
+            return await get_openai_client().chat.completions.create(**kwargs)
+
+    async with current_shard().chat_semaphore:
+        response = await api_scheduler.call(chat_limiter, attempt, tokens=estimate_chat_tokens(kwargs))
+    metrics.record_usage(kwargs.get("model"), response.usage)
+    return response
+
+
+async def stream_chat_completion(on_delta, kind="chat", **kwargs):
+    """Chat Completionsをストリーミングで呼び出し、受信のたびにon_delta(ここまでの本文)を呼ぶ関数
+
+    トークン使用量は最後のチャンクで受け取る（返ってこなければ文字数から見積もる）。
+    途中で切れた場合は最初から受信し直す。
+    """
+    import httpx
+    import openai
+    from openai.types import CompletionUsage
+
+    async def attempt():
+        with metrics.timer("openai", endpoint="chat_stream", kind=kind):
+            stream = await get_openai_client().chat.completions.create(
+                stream=True, extra_body={"stream_options": {"include_usage": True}}, **kwargs
+            )
+            content = ""
+            usage = None
+            try:
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        content += chunk.choices[0].delta.content
+                        on_delta(content)
+            except httpx.TransportError as e:
+                # 受信中の切断はhttpxの例外のまま届くため、接続エラーとして再試行させる
+                raise openai.APIConnectionError(
+                    message=f"ストリーミングの受信中に接続が切れました: {e}", request=stream.response.request
+                ) from e
+            if isinstance(usage, dict):
+                usage = CompletionUsage(**usage)
+            if usage is None:
+                prompt_tokens = estimate_chat_tokens({**kwargs, "max_tokens": 0})
+                usage = CompletionUsage(
+                    prompt_tokens=prompt_tokens, completion_tokens=len(content),
+                    total_tokens=prompt_tokens + len(content),
+                )
+            # 使用量はRetrySchedulerがTPMの見積もりの精算に使う
+            return SimpleNamespace(content=content, usage=usage)
+
+    async with current_shard().chat_semaphore:
+        response = await api_scheduler.call(chat_limiter, attempt, tokens=estimate_chat_tokens(kwargs))
+    metrics.record_usage(kwargs.get("model"), response.usage)
+    return response.content
+
+
+async def create_transcription(**kwargs):
+    """レート制限と再試行を管理しつつWhisper APIを呼び出す関数
+
+    ファイルからストリーミングアップロードする場合は、試行のたびに巻き戻してから送る。
+    """
+    audio_file = kwargs["file"][1]
+
+    async def attempt():
+        if hasattr(audio_file, "seek"):
+            audio_file.seek(0)
+        with metrics.timer("openai", endpoint="whisper", kind="transcription"):
+            return await get_openai_client().audio.transcriptions.create(**kwargs)
+
+    async with current_shard().whisper_semaphore:
+        return await api_scheduler.call(whisper_limiter, attempt)
+
+
+# API全体のレート調整の状況はメトリクス参照時に読む
+metrics.gauge("openai_chat_rate_scale", lambda: round(chat_limiter.scale, 2))
+metrics.gauge("openai_whisper_rate_scale", lambda: round(whisper_limiter.scale, 2))
@@ -0,0 +1,231 @@
+"""メモ1件分の処理パイプラインと、ワーカーで順番に処理するキュー"""
+import asyncio
+import time
+from collections import deque
+
+from .index import load_note_index
+from .metrics import metrics
+from .progress import ProgressMessage
+from .related import find_related_notes
+from .summary import convert_to_sns_post, summarize_with_chatgpt
+from .writer import save_to_obsidian
+
+
+class QueueFullError(Exception):
+    """メモ処理キューが満杯で受け付けられないことを表す例外"""
+
+
+# 起動時に取り込むメモの順番待ちの単位（ライブの投稿者と交互に処理される）
+CATCHUP_QUEUE_KEY = "catchup"
+
+
+class MemoJob:
+    """キューに積まれるメモ1件分の処理単位"""
+
+    def __init__(self, message, kind, shard, resumed=False, user_id=None):
+        self.message = message
+        self.kind = kind
+        self.shard = shard
+        self.resumed = resumed
+        # キューの公平性の単位（通常は投稿者、取り込みは全体で1つ）
+        self.user_id = user_id if user_id is not None else message.author.id
+        self.enqueued_at = time.monotonic()
+        self.progress = ProgressMessage(message)
+
+
+class MemoPipeline:
+    """有界キューとワーカープールでメモを処理するパイプライン
+
+    ユーザーごとにキューを分け、ラウンドロビンで取り出すことで
+    1人の大量投稿が他のユーザーのメモを待たせないようにする。
+    """
+
+    def __init__(self, handler, workers=3, maxsize=50, per_user_limit=10):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.per_user_limit = per_user_limit
+        # user_id -> deque[MemoJob]
+        self._queues = {}
+        # 次に取り出すユーザーの順番
+        self._order = deque()
+        self._size = 0
+        self._items = asyncio.Semaphore(0)
+        self._space = asyncio.Event()
+        self._active = set()
+        self._worker_tasks = []
+
+    @property
+    def depth(self):
+        """処理待ちのメモ件数"""
+        return self._size
+
+    @property
+    def active(self):
+        """処理中のメモ件数"""
+        return len(self._active)
+
+    def start(self):
+        """ワーカーを起動する（複数回呼んでも一度だけ起動）"""
+        if self._worker_tasks:
+            return
+        for i in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker(i), name=f"memo-worker-{i}"))
+
+    def submit(self, job):
+        """メモをキューに積み、待ち行列内での順番（1始まり）を返す"""
+        if self._size >= self.maxsize:
+            raise QueueFullError(f"待ち {self._size} 件")
+        user_queue = self._queues.get(job.user_id)
+        if user_queue is not None and len(user_queue) >= self.per_user_limit:
+            raise QueueFullError(f"あなたの待ち {len(user_queue)} 件")
+        if user_queue is None:
+            user_queue = self._queues[job.user_id] = deque()
+            self._order.append(job.user_id)
+        user_queue.append(job)
+        self._size += 1
+        self._items.release()
+        return self.positions(job.user_id)[-1]
+
+    async def put(self, job):
+        """キューに空きができるまで待ってからメモを積む（再開・取り込みなど、断れない投入用）"""
+        while True:
+            try:
+                return self.submit(job)
+            except QueueFullError:
+                self._space.clear()
+                await self._space.wait()
+
+    def positions(self, user_id):
+        """ユーザーのメモが何番目に取り出されるか（待ち行列内、1始まり）を返す"""
+        remaining = {uid: len(q) for uid, q in self._queues.items()}
+        order = list(self._order)
+        positions = []
+        pos = 0
+        round_index = 0
+        while order:
+            next_order = []
+            for uid in order:
+                if remaining[uid] > round_index:
+                    pos += 1
+                    if uid == user_id:
+                        positions.append(pos)
+                    if remaining[uid] > round_index + 1:
+                        next_order.append(uid)
+            order = next_order
+            round_index += 1
+        return positions
+
+    def active_jobs(self, user_id):
+        """ユーザーのメモのうち処理中の件数"""
+        return sum(1 for job in self._active if job.user_id == user_id)
+
+    def _pop(self):
+        user_id = self._order.popleft()
+        user_queue = self._queues[user_id]
+        job = user_queue.popleft()
+        if user_queue:
+            self._order.append(user_id)
+        else:
+            del self._queues[user_id]
+        self._size -= 1
+        self._space.set()
+        return job
+
+    async def _worker(self, index):
+        while True:
+            await self._items.acquire()
+            job = self._pop()
+            self._active.add(job)
+            try:
+                wait = time.monotonic() - job.enqueued_at
+                print(f"ワーカー{index}: メモ処理開始（待ち時間 {wait:.2f}s / 残り {self._size} 件）")
+                await self.handler(job)
+            except Exception as e:
+                print(f"ワーカー{index}でエラーが発生しました: {e}")
+            finally:
+                self._active.discard(job)
+
+
+async def run_task_graph(stages, on_stage_done=None):
+    """依存関係のあるステージを並行実行し、(結果, ステージごとの所要時間) を返す関数
+
+    stages は {ステージ名: (依存ステージ名のタプル, 結果dictを受け取るasync関数)} の形式。
+    依存が揃ったステージから順に開始するため、全体の所要時間はクリティカルパスに近くなる。
+    on_stage_done(ステージ名, 結果dict) は各ステージの完了直後に呼ばれる。
+    """
+    results = {}
+    timings = {}
+    tasks = {}
+
+    async def run_stage(name):
+        deps, func = stages[name]
+        if deps:
+            await asyncio.gather(*(tasks[dep] for dep in deps))
+        start = time.perf_counter()
+        results[name] = await func(results)
+        timings[name] = time.perf_counter() - start
+        if on_stage_done:
+            on_stage_done(name, results)
+
+    for name in stages:
+        tasks[name] = asyncio.create_task(run_stage(name), name=f"stage:{name}")
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+
+    return results, timings
+
+
+async def process_memo(get_raw_text, progress=None, checkpoint=None):
+    """メモ1件分のパイプライン（文字起こし→要約/関連分析→SNS変換→保存）を実行する関数
+
+    progressを渡すと、各ステージの結果をその場で進捗メッセージに反映する。
+    checkpointを渡すと、各ステージの出力を保存し、保存済みのステージは実行しない。
+    """
+    def on_summary_delta(partial):
+        progress.set("summary", f"🧠 **要約**（生成中）\n{partial}")
+        progress.update()
+
+    stages = {
+        # 文字起こし（テキストメモの場合はそのまま）
+        "raw_text": ((), lambda r: get_raw_text()),
+        # 既存ノートのインデックスの読み込み（文字起こしと並行）
+        "notes": ((), lambda r: load_note_index()),
+        # ChatGPTで要約・整形
+        "summary": (("raw_text",), lambda r: summarize_with_chatgpt(r["raw_text"], on_summary_delta if progress else None)),
+        # 関連性分析（要約を待たずに元テキストで実行）
+        "related": (("raw_text", "notes"), lambda r: find_related_notes(r["raw_text"], r["notes"])),
+        # SNS投稿用変換
+        "sns": (("summary",), lambda r: convert_to_sns_post(r["summary"])),
+        # Obsidianに保存（関連ノートも含める）
+        "save": (("raw_text", "summary", "related", "sns"), lambda r: _save_stage(r, checkpoint)),
+    }
+    if checkpoint is not None:
+        stages = checkpoint.wrap(stages)
+
+    start = time.perf_counter()
+    results, timings = await run_task_graph(stages, progress.on_stage_done if progress else None)
+    total = time.perf_counter() - start
+
+    timing_text = " / ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+    print(f"処理時間: 合計 {total:.2f}s（{timing_text}）")
+    for name, seconds in timings.items():
+        metrics.observe("stage_seconds", seconds, stage=name)
+    metrics.observe("stage_seconds", total, stage="memo_total")
+    metrics.inc("memos_processed_total")
+
+    results["timings"] = timings
+    results["total_time"] = total
+    return results
+
+
+async def _save_stage(results, checkpoint=None):
+    return await save_to_obsidian(
+        results["raw_text"], results["summary"], results["related"], results["sns"], checkpoint
+    )
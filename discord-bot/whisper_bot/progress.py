@@ -0,0 +1,171 @@
+"""Discordへの返信（進捗メッセージの編集と結果の整形）"""
+import asyncio
+import time
+
+from .config import DISCORD_MESSAGE_LIMIT, PROGRESS_EDIT_INTERVAL
+from .metrics import metrics
+from .ratelimit import discord_pacer
+
+
+class ProgressMessage:
+    """1つの返信メッセージを、処理の進行に合わせて編集し続けるクラス
+
+    編集はmin_intervalごとにまとめて行い、DiscordのAPI呼び出しを抑える。
+    """
+
+    # 進捗表示で各セクションを切り詰める長さ
+    SECTION_LIMIT = 600
+
+    # ステージ完了時に表示する内容
+    STAGE_LABELS = {
+        "raw_text": "🧠 要約・関連ノート検索中...",
+        "summary": "📱 SNS投稿用テキストを作成中...",
+        "sns": "💾 Obsidianに保存中...",
+    }
+
+    def __init__(self, message, min_interval=PROGRESS_EDIT_INTERVAL):
+        self.message = message
+        self.min_interval = min_interval
+        # 表示順に並んだセクション（key -> テキスト）
+        self.sections = {"status": "", "transcript": "", "summary": "", "related": "", "sns": ""}
+        self.reply = None
+        # 最終結果を表示したメッセージ（長い場合は続きの返信も含む）
+        self.result_messages = []
+        self._lock = asyncio.Lock()
+        self._last_edit = 0.0
+        self._last_content = None
+        self._pending = None
+        self._finished = False
+
+    def set(self, key, text):
+        self.sections[key] = text
+
+    def render(self):
+        parts = []
+        for text in self.sections.values():
+            if not text:
+                continue
+            if len(text) > self.SECTION_LIMIT:
+                text = text[:self.SECTION_LIMIT] + "…"
+            parts.append(text)
+        return "\n\n".join(parts)[:DISCORD_MESSAGE_LIMIT]
+
+    def on_stage_done(self, name, results):
+        """パイプラインの各ステージ完了時に表示を更新する"""
+        if name == "raw_text":
+            self.set("transcript", f"📝 **文字起こし**\n{results['raw_text']}")
+        elif name == "summary":
+            self.set("summary", f"🧠 **要約**\n{results['summary']}")
+        elif name == "related" and results["related"]:
+            self.set("related", f"🔗 **関連ノート発見**: {', '.join(results['related'])}")
+        elif name == "sns":
+            self.set("sns", f"📱 **SNS投稿用**\n{results['sns']}")
+        if name in self.STAGE_LABELS:
+            self.set("status", self.STAGE_LABELS[name])
+        self.update()
+
+    def update(self):
+        """表示の更新を予約する（間隔を空けてまとめて編集する）"""
+        if self._finished or self._pending is not None:
+            return
+        delay = max(0.0, self._last_edit + self.min_interval - time.monotonic())
+        self._pending = asyncio.create_task(self._delayed_flush(delay))
+
+    async def _delayed_flush(self, delay):
+        await asyncio.sleep(delay)
+        self._pending = None
+        try:
+            await self.flush(optional=True)
+        except Exception as e:
+            print(f"進捗メッセージの更新でエラー: {e}")
+
+    async def flush(self, view=None, optional=False):
+        """現在の内容で直ちに返信を作成または編集する
+
+        optionalなら、Discordの送信枠が空いていないときは編集を見送って後で再試行する
+        （途中経過の編集で最終結果の送信枠を使い切らないため）。
+        """
+        async with self._lock:
+            if self._finished:
+                return
+            content = self.render()
+            if content == self._last_content and view is None:
+                return
+            kwargs = {"view": view} if view is not None else {}
+            if optional and self.reply is not None:
+                if not discord_pacer.try_send(self.message.channel.id):
+                    self._last_edit = time.monotonic()
+                    self.update()
+                    return
+            else:
+                await discord_pacer.wait(self.message.channel.id)
+            with metrics.timer("discord", call="progress"):
+                if self.reply is None:
+                    self.reply = await self.message.reply(content, **kwargs)
+                else:
+                    await self.reply.edit(content=content, **kwargs)
+            self._last_content = content
+            self._last_edit = time.monotonic()
+
+    async def finish(self, chunks, view):
+        """最終結果で進捗メッセージを置き換える（長い場合は続きを返信する）"""
+        self._finished = True
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        async with self._lock:
+            first, rest = chunks[0], chunks[1:]
+            first_view = view if not rest else None
+            await discord_pacer.wait(self.message.channel.id)
+            with metrics.timer("discord", call="result"):
+                if self.reply is None:
+                    self.reply = await self.message.reply(first, **({"view": first_view} if first_view else {}))
+                else:
+                    await self.reply.edit(content=first, **({"view": first_view} if first_view else {}))
+                self.result_messages = [self.reply]
+                for i, chunk in enumerate(rest):
+                    await discord_pacer.wait(self.message.channel.id)
+                    if i == len(rest) - 1:
+                        self.result_messages.append(await self.message.reply(chunk, view=view))
+                    else:
+                        self.result_messages.append(await self.message.reply(chunk))
+
+    async def fail(self, text):
+        """エラー内容で進捗メッセージを置き換える"""
+        await self.finish([text], None)
+
+
+def format_memo_result(result, done_text):
+    """メモ1件分の結果を返信用のテキストにまとめる関数"""
+    title = f"🎙️ **{result['title']}**\n" if result.get("title") else ""
+    if "error" in result:
+        return f"{title}{result['error']}"
+
+    text = f"{title}{done_text}\nファイル名: {result['save']}\n"
+    if result.get("memo_id"):
+        text += f"メモID: #{result['memo_id']}（`再生成 {result['memo_id']}` でSNS文章を作り直せます）\n"
+    if result["related"]:
+        text += f"🔗 **関連ノート発見**: {', '.join(result['related'])}\n"
+    text += f"\n📱 **SNS投稿用**\n{result['sns']}\n"
+    text += f"\n📝 **元の文字起こし**\n{result['raw_text']}"
+    return text
+
+
+def split_discord_message(text, limit=DISCORD_MESSAGE_LIMIT):
+    """Discordの文字数上限に収まるように、なるべく行単位でテキストを分割する関数"""
+    chunks = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,124 @@
+"""トークンバケットによるレート制限（OpenAIのRPM/TPMとDiscordへの送信ペース）"""
+import asyncio
+import time
+
+from .config import DISCORD_CHANNEL_BURST, DISCORD_CHANNEL_PER_MINUTE, RATE_LIMIT_BURST_SECONDS
+
+
+class TokenBucket:
+    """一定の速度で補充されるトークンバケット
+
+    送信レートはAIMDで増減できるよう、設定値に対する倍率 scale を持つ。
+    """
+
+    def __init__(self, rate_per_minute, burst_seconds=RATE_LIMIT_BURST_SECONDS, capacity=None):
+        self.base_rate = rate_per_minute / 60
+        self.capacity = capacity or max(1.0, self.base_rate * burst_seconds)
+        self.scale = 1.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @property
+    def rate(self):
+        return self.base_rate * self.scale
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """amount分のトークンが貯まるまで待ってから消費する（先着順）"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def try_acquire(self, amount=1):
+        """待たずに消費できればTrueを返す"""
+        if self._lock.locked():
+            return False
+        self._refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def adjust(self, amount):
+        """見積もりとの差を精算する（負なら追加で消費する）"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def set_scale(self, scale):
+        self._refill()
+        self.scale = scale
+
+
+class EndpointLimiter:
+    """APIエンドポイントごとのRPM/TPMの予算と同時実行数
+
+    429を受けたら送信レートを半分に下げて貯まっていたトークンも捨て（乗算減少）、
+    成功するたびに少しずつ設定値まで戻す（加算増加）。
+    """
+
+    MIN_SCALE = 0.05
+    INCREASE_STEP = 0.05
+
+    def __init__(self, name, rpm, tpm=None, concurrency=4):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def _buckets(self):
+        return [bucket for bucket in (self.requests, self.tokens) if bucket is not None]
+
+    @property
+    def scale(self):
+        return self.requests.scale
+
+    async def acquire(self, tokens=0):
+        await self.requests.acquire()
+        if self.tokens is not None and tokens:
+            await self.tokens.acquire(tokens)
+
+    def on_success(self):
+        for bucket in self._buckets():
+            if bucket.scale < 1.0:
+                bucket.set_scale(min(1.0, bucket.scale + self.INCREASE_STEP))
+
+    def on_throttled(self):
+        for bucket in self._buckets():
+            bucket.set_scale(max(self.MIN_SCALE, bucket.scale / 2))
+            bucket.tokens = min(bucket.tokens, 0.0)
+
+
+class ChannelPacer:
+    """Discordへの送信・編集をチャンネルごとのペースに揃えるクラス（429を受ける前に待つ）"""
+
+    def __init__(self, per_minute=DISCORD_CHANNEL_PER_MINUTE, burst=DISCORD_CHANNEL_BURST):
+        self.per_minute = per_minute
+        self.burst = burst
+        self._buckets = {}
+
+    def _bucket(self, channel_id):
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = TokenBucket(self.per_minute, capacity=self.burst)
+        return bucket
+
+    async def wait(self, channel_id):
+        await self._bucket(channel_id).acquire()
+
+    def try_send(self, channel_id):
+        """枠が空いていればTrue（途中経過の編集など、省略できる送信に使う）"""
+        return self._bucket(channel_id).try_acquire()
+
+
+# Discordへの返信・編集のペース
+discord_pacer = ChannelPacer()
@@ -0,0 +1,228 @@
+"""既存ノートとの関連性分析（混雑時は複数のメモを1リクエストにまとめる）"""
+import asyncio
+import json
+
+from .cache import cached_chat_completion
+from .config import (
+    RELATED_BATCH_MAX,
+    RELATED_BATCH_WINDOW,
+    RELATED_CANDIDATE_K,
+    RELATED_NOTES_MAX,
+    RELATED_NOTES_USE_LLM,
+)
+from .metrics import metrics
+from .runtime import current_shard
+
+
+RELATED_SYSTEM_PROMPT = """あなたは音声メモの関連性分析を行うアシスタントです。
+                    新しいメモの内容と既存ノートを比較し、内容的に関連があるものを特定してください。
+                    
+                    関連性の基準：
+                    - 同じトピック、テーマ
+                    - 関連する技術、概念
+                    - 続きや発展的な内容
+                    - 類似の課題や解決策
+                    """
+
+
+async def find_related_notes(new_content, note_index):
+    """新しいメモと既存ノートの関連性を分析する関数"""
+    if note_index is None or not len(note_index):
+        return []
+    
+    try:
+        # BM25で関連しそうな候補だけに絞り込む（Vault全体をプロンプトに載せない）
+        # 候補のヘッダーはこの時点の内容をコピーして使う（Vaultのスレッドからの更新と競合しない）
+        existing_notes = note_index.headers(name for name, _ in note_index.search(new_content, RELATED_CANDIDATE_K))
+        candidates = list(existing_notes)
+        if not candidates:
+            return []
+        if not RELATED_NOTES_USE_LLM:
+            print(f"関連ノート発見（BM25）: {candidates[:RELATED_NOTES_MAX]}")
+            return candidates[:RELATED_NOTES_MAX]
+
+        if RELATED_BATCH_MAX > 1:
+            valid_files = await current_shard().related_batcher.submit(new_content, candidates, existing_notes)
+        else:
+            valid_files = await analyze_related_notes(new_content, candidates, existing_notes)
+        print(f"関連ノート発見: {valid_files}")
+        return valid_files
+        
+    except Exception as e:
+        print(f"関連性分析でエラー: {e}")
+        return []
+
+
+async def analyze_related_notes(new_content, candidates, existing_notes):
+    """1件のメモについて、候補ノートの中から関連するものをChatGPTに選ばせる関数"""
+    # 候補ノートのリストを作成
+    notes_summary = "\n".join([f"- {filename}: {existing_notes[filename][:100]}..." for filename in candidates])
+    
+    result = await cached_chat_completion(
+        "related",
+        model=current_shard().chat_model,
+        messages=[
+            {
+                "role": "system",
+                "content": RELATED_SYSTEM_PROMPT + """
+                    応答形式：
+                    関連するファイル名のみをカンマ区切りで返してください（拡張子なし）。
+                    関連がない場合は「なし」と返してください。"""
+            },
+            {
+                "role": "user",
+                "content": f"""新しいメモ内容：
+{new_content}
+
+既存ノート一覧：
+{notes_summary}
+
+関連するノートのファイル名を教えてください。"""
+            }
+        ],
+        max_tokens=200,
+        temperature=0.3
+    )
+    result = result.strip()
+    
+    if result.lower() == "なし" or not result:
+        return []
+        
+    # カンマ区切りでファイル名を分割
+    related_files = [name.strip() for name in result.split(',') if name.strip()]
+    
+    # 実際に存在するファイルのみを返す
+    return [name for name in related_files if name in existing_notes]
+
+
+async def analyze_related_notes_batch(batch):
+    """複数メモの関連ノート分析を1回のリクエストで行い、メモごとの結果のリストを返す関数
+
+    batch は (メモ内容, 候補ノート, 既存ノート) のリスト。候補ノートの和集合を
+    名前順でプロンプトの先頭に置き（同じVaultなら先頭が揃ってプロンプトキャッシュが効く）、
+    メモごとの結果をJSONで受け取る。
+    """
+    # ヘッダーは各メモが候補を選んだときの内容を使う（メモごとにインデックスの時点が違うため）
+    headers = {}
+    for _, candidates, existing_notes in batch:
+        for name in candidates:
+            headers.setdefault(name, existing_notes[name])
+    notes_summary = "\n".join([f"- {filename}: {headers[filename][:100]}..." for filename in sorted(headers)])
+    memos_text = "\n\n".join(f"[{i}]\n{content}" for i, (content, _, _) in enumerate(batch, 1))
+
+    result = await cached_chat_completion(
+        "related_batch",
+        model=current_shard().chat_model,
+        messages=[
+            {
+                "role": "system",
+                "content": RELATED_SYSTEM_PROMPT + """
+                    複数の新しいメモが番号付きで渡されます。メモごとに判定してください。
+
+                    応答形式：
+                    メモ番号をキー、関連するファイル名（拡張子なし）の配列を値とするJSONオブジェクトのみを返してください。
+                    例: {"1": ["ノートA", "ノートB"], "2": []}"""
+            },
+            {
+                "role": "user",
+                "content": f"""既存ノート一覧：
+{notes_summary}
+
+新しいメモ：
+{memos_text}
+
+各メモに関連するノートのファイル名を教えてください。"""
+            }
+        ],
+        max_tokens=100 + 100 * len(batch),
+        temperature=0.3,
+        response_format={"type": "json_object"},
+    )
+    mapping = json.loads(result)
+    if not isinstance(mapping, dict):
+        raise ValueError(f"関連ノート分析の応答がJSONオブジェクトではありません: {result[:100]}")
+    results = []
+    for i, (_, _, notes) in enumerate(batch, 1):
+        names = mapping.get(str(i)) or []
+        if isinstance(names, str):
+            names = [name.strip() for name in names.split(',')]
+        results.append([name for name in names if isinstance(name, str) and name in notes])
+    return results
+
+
+class RelatedNotesBatcher:
+    """混雑時に、近いタイミングで届いたメモの関連ノート分析を1回のリクエストにまとめるクラス
+
+    分析中のリクエストがなければすぐに送り、あれば window 秒（または max_size 件）まで
+    待ってまとめて送る。空いているときは待ち時間が増えない。
+    """
+
+    def __init__(self, window=RELATED_BATCH_WINDOW, max_size=RELATED_BATCH_MAX):
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._timer = None
+        self._inflight = 0
+        self._tasks = set()
+
+    async def submit(self, content, candidates, existing_notes):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((content, candidates, existing_notes, future))
+        if self._inflight == 0 or len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        self._flush()
+
+    def _flush(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # タスクが動き出す前に届いたメモもまとめられるよう、作った時点で分析中に数える
+            self._inflight += 1
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        metrics.inc("related_requests_total", batched="yes" if len(batch) > 1 else "no")
+        metrics.inc("related_memos_total", len(batch))
+        try:
+            if len(batch) == 1:
+                content, candidates, existing_notes, _ = batch[0]
+                results = [await analyze_related_notes(content, candidates, existing_notes)]
+            else:
+                print(f"関連ノート分析を {len(batch)} 件まとめて実行します")
+                try:
+                    results = await analyze_related_notes_batch([item[:3] for item in batch])
+                except Exception as e:
+                    # まとめた分析に失敗したら、1件ずつ分析し直す（1件の失敗で全員を空にしない）
+                    print(f"まとめた関連ノート分析でエラー（1件ずつ分析し直します）: {e}")
+                    metrics.inc("related_batch_fallbacks_total")
+                    results = await asyncio.gather(
+                        *(analyze_related_notes(*item[:3]) for item in batch), return_exceptions=True
+                    )
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (*_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self._inflight -= 1
+            # 待っている間に溜まった分は、分析中のものがなくなった時点で送る
+            if self._pending and self._inflight == 0:
+                self._flush()
@@ -0,0 +1,30 @@
+"""処理中のシャードと、ブロッキング処理の実行"""
+import asyncio
+import contextvars
+import functools
+
+
+async def run_blocking(executor, func, *args):
+    """executorがあればそこで、なければ既定のスレッドプールでfuncを実行する関数"""
+    if executor is None:
+        return await asyncio.to_thread(func, *args)
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+
+
+# 処理中のメモが属するシャード（メッセージ受信時・ジョブ処理時に設定する）
+_current_shard = contextvars.ContextVar("current_shard", default=None)
+
+
+def set_current_shard(shard):
+    """以降の処理（同じタスク内）の対象シャードを設定する関数"""
+    _current_shard.set(shard)
+
+
+def current_shard():
+    """処理中のシャードを返す関数（未設定なら最初のシャード）"""
+    shard = _current_shard.get()
+    if shard is None:
+        # shardsはこのモジュールに依存するため、ここで読み込む
+        from .shards import get_shard_router
+        shard = get_shard_router().shards[0]
+    return shard
@@ -0,0 +1,193 @@
+"""チャンネル（またはサーバー）ごとのVault・キュー・設定（シャード）と、その振り分け"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import ResultCache
+from .config import (
+    ALLOWED_CHANNEL_IDS,
+    BOT_DATA_DIR,
+    CHAT_MAX_CONCURRENCY,
+    CHAT_MODEL,
+    MEMO_JOURNAL_PATH,
+    MEMO_QUEUE_MAXSIZE,
+    MEMO_QUEUE_PER_USER,
+    MEMO_WORKERS,
+    NOTE_INDEX_SNAPSHOT_PATH,
+    OBSIDIAN_VAULT_FOLDER_PATH,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_ENABLED,
+    SHARDS_CONFIG_PATH,
+    SHARD_PROCESS_COUNT,
+    SHARD_PROCESS_INDEX,
+    SHARD_VAULT_THREADS,
+    WHISPER_MAX_CONCURRENCY,
+    WHISPER_MODEL,
+)
+from .index import NoteIndex
+from .journal import MemoJournal
+from .metrics import metrics
+from .pipeline import MemoPipeline
+from .related import RelatedNotesBatcher
+from .writer import NoteWriter
+
+
+class Shard:
+    """チャンネル（またはサーバー）とVaultの組ごとの処理単位
+
+    ノートインデックス・ノート書き込み・結果キャッシュ・ジャーナル・メモ処理キュー・
+    同時実行数・モデル設定をシャードごとに持ち、Vaultの読み書きは専用のスレッドで行う。
+    ジャーナルとインデックスのスナップショットは、指定がなければ BOT_DATA_DIR/<シャード名>/ に置く。
+    """
+
+    def __init__(self, name, vault_path, channel_ids=(), guild_ids=(), chat_model=CHAT_MODEL,
+                 whisper_model=WHISPER_MODEL, index_snapshot_path=None, journal_path=None,
+                 cache_dir=RESULT_CACHE_DIR, memo_workers=MEMO_WORKERS, queue_maxsize=MEMO_QUEUE_MAXSIZE,
+                 queue_per_user=MEMO_QUEUE_PER_USER, chat_max_concurrency=CHAT_MAX_CONCURRENCY,
+                 whisper_max_concurrency=WHISPER_MAX_CONCURRENCY, vault_threads=SHARD_VAULT_THREADS, handler=None):
+        self.name = name
+        self.vault_path = vault_path
+        self.channel_ids = set(map(int, channel_ids))
+        self.guild_ids = set(map(int, guild_ids))
+        self.chat_model = chat_model
+        self.whisper_model = whisper_model
+        self.executor = ThreadPoolExecutor(max_workers=vault_threads, thread_name_prefix=f"vault-{name}")
+        self.note_index = NoteIndex(
+            vault_path, index_snapshot_path or os.path.join(BOT_DATA_DIR, name, "note_index.json"), executor=self.executor
+        )
+        self.note_writer = NoteWriter(vault_path, self.note_index, executor=self.executor)
+        self.result_cache = ResultCache(cache_dir, enabled=RESULT_CACHE_ENABLED, executor=self.executor)
+        self.memo_journal = MemoJournal(
+            journal_path or os.path.join(BOT_DATA_DIR, name, "memo_journal.sqlite3"), executor=self.executor
+        )
+        self.memo_pipeline = MemoPipeline(
+            handler, workers=memo_workers, maxsize=queue_maxsize, per_user_limit=queue_per_user
+        )
+        self.related_batcher = RelatedNotesBatcher()
+        self._resume_task = None
+        self.chat_semaphore = asyncio.Semaphore(chat_max_concurrency)
+        self.whisper_semaphore = asyncio.Semaphore(whisper_max_concurrency)
+
+        metrics.gauge("queue_depth", lambda: self.memo_pipeline.depth, shard=name)
+        metrics.gauge("queue_active", lambda: self.memo_pipeline.active, shard=name)
+        metrics.gauge("cache_hits", lambda: self.result_cache.hits, shard=name)
+        metrics.gauge("cache_misses", lambda: self.result_cache.misses, shard=name)
+        metrics.gauge("cache_bytes", lambda: self.result_cache.stats()["bytes"], shard=name)
+        metrics.gauge("indexed_notes", lambda: len(self.note_index), shard=name)
+
+    # 設定ファイルで指定できる項目 -> コンストラクタの引数
+    CONFIG_KEYS = {
+        "name": "name", "vault": "vault_path", "channels": "channel_ids", "guilds": "guild_ids",
+        "chat_model": "chat_model", "whisper_model": "whisper_model",
+        "index_snapshot": "index_snapshot_path", "journal": "journal_path", "cache_dir": "cache_dir",
+        "memo_workers": "memo_workers", "queue_maxsize": "queue_maxsize", "queue_per_user": "queue_per_user",
+        "chat_max_concurrency": "chat_max_concurrency", "whisper_max_concurrency": "whisper_max_concurrency",
+        "vault_threads": "vault_threads",
+    }
+
+    @classmethod
+    def from_config(cls, entry, handler=None):
+        unknown = set(entry) - set(cls.CONFIG_KEYS) - {"process"}
+        if unknown:
+            raise ValueError(f"シャード設定に不明な項目があります: {sorted(unknown)}")
+        kwargs = {cls.CONFIG_KEYS[key]: value for key, value in entry.items() if key in cls.CONFIG_KEYS}
+        kwargs.setdefault("cache_dir", os.path.join(RESULT_CACHE_DIR, entry["name"]))
+        return cls(handler=handler, **kwargs)
+
+    async def start(self, recover=None):
+        """ワーカーを起動し、インデックスを読み込む（読み込み中に届いたメモは読み込み後に処理される）
+
+        recoverを渡すと、未完了ジョブの再開などをrecover(shard)としてバックグラウンドで一度だけ実行する。
+        """
+        self.memo_pipeline.start()
+        if recover is not None and self._resume_task is None:
+            self._resume_task = asyncio.create_task(recover(self))
+        await self.note_index.ensure_loaded()
+        self.note_index.start_refresh_loop()
+        print(f'[{self.name}] 既存ノート {len(self.note_index)} 件をインデックスしました'
+              f'（メモ処理ワーカー {self.memo_pipeline.workers} 件）')
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class ShardRouter:
+    """メッセージのチャンネル（スレッドなら親チャンネル）とサーバーから担当シャードを決めるクラス
+
+    振り分けは全シャードの設定で行い、このプロセスが担当しないシャード宛てのメッセージは無視する。
+    """
+
+    def __init__(self, configs, process_index=0, process_count=1, handler=None):
+        self.shards = []
+        self._by_channel = {}
+        self._by_guild = {}
+        local = {}
+        for i, entry in enumerate(configs):
+            name = entry["name"]
+            if entry.get("process", i % process_count) == process_index:
+                local[name] = Shard.from_config(entry, handler)
+                self.shards.append(local[name])
+            for channel_id in map(int, entry.get("channels", ())):
+                if channel_id in self._by_channel:
+                    raise ValueError(f"チャンネル {channel_id} が複数のシャードに設定されています")
+                self._by_channel[channel_id] = name
+            for guild_id in map(int, entry.get("guilds", ())):
+                if guild_id in self._by_guild:
+                    raise ValueError(f"サーバー {guild_id} が複数のシャードに設定されています")
+                self._by_guild[guild_id] = name
+        if not self.shards:
+            raise ValueError(
+                f"プロセス {process_index}/{process_count} が担当するシャードがありません"
+                f"（SHARD_PROCESS_INDEX・SHARD_PROCESS_COUNTとシャード設定の process を確認してください）"
+            )
+        self._local = local
+
+    def route(self, message):
+        """担当シャードを返す（対象外、または他のプロセスの担当ならNone）"""
+        channel = message.channel
+        for channel_id in (channel.id, getattr(channel, "parent_id", None)):
+            if channel_id in self._by_channel:
+                return self._local.get(self._by_channel[channel_id])
+        guild = getattr(message, "guild", None)
+        if guild is not None and guild.id in self._by_guild:
+            return self._local.get(self._by_guild[guild.id])
+        return None
+
+
+def load_shard_configs(path=SHARDS_CONFIG_PATH):
+    """シャード設定を読み込む関数（未指定なら環境変数から1シャードだけ作る）
+
+    設定ファイルの形式:
+        {"shards": [{"name": "team-a", "vault": "/path/to/vault", "channels": [123], "guilds": [456],
+                     "chat_model": "gpt-4o-mini", "memo_workers": 2, ...}, ...]}
+    """
+    if not path:
+        return [{
+            "name": "default",
+            "vault": OBSIDIAN_VAULT_FOLDER_PATH,
+            "channels": ALLOWED_CHANNEL_IDS,
+            "index_snapshot": NOTE_INDEX_SNAPSHOT_PATH,
+            "journal": MEMO_JOURNAL_PATH,
+        }]
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    shards = config["shards"] if isinstance(config, dict) else config
+    names = [entry["name"] for entry in shards]
+    if len(set(names)) != len(names):
+        raise ValueError("シャード名が重複しています")
+    return shards
+
+
+_shard_router = None
+
+
+def get_shard_router(handler=None):
+    """シャードの振り分けを返す関数（初回の呼び出し時に、このプロセスが担当するシャードだけを作る）
+
+    handlerは各シャードのメモ処理キューのワーカーが呼ぶ関数で、初回に作るときだけ使われる。
+    """
+    global _shard_router
+    if _shard_router is None:
+        _shard_router = ShardRouter(load_shard_configs(), SHARD_PROCESS_INDEX, SHARD_PROCESS_COUNT, handler)
+    return _shard_router
@@ -0,0 +1,116 @@
+"""ChatGPTによる要約と、SNS投稿用テキストの作成"""
+from .cache import cached_chat_completion
+from .config import REGENERATE_TEMPERATURE, REGENERATE_VARIANTS, SNS_MAX_CHARS
+from .openai_client import create_chat_completion
+from .runtime import current_shard
+
+
+async def summarize_with_chatgpt(text, on_delta=None):
+    """ChatGPT APIを使ってテキストを要約・整形する関数（on_deltaで途中経過を受け取れる）"""
+    try:
+        summary = await cached_chat_completion(
+            "summary",
+            on_delta=on_delta,
+            model=current_shard().chat_model,
+            messages=[
+                {
+                    "role": "system", 
+                    "content": """あなたは音声メモの要約・整形を行うアシスタントです。
+                    以下のルールで音声メモを処理してください：
+                    
+                    1. 結論から書く
+                    2. 抽象的な表現は避け、具体的に表現する
+                    3. 内容が濃い場合はPREP法（結論→理由→具体例→結論）を使う
+                    4. なるべく言い切りの表現を使う
+                    5. 同じ単語の繰り返しを避け、類義語や言い換えを積極的に使う
+                    6. 重要なキーワードを箇条書きで抽出
+                    7. 関連する行動項目があれば「TODO」として記載
+                    8. 上から目線ではなく、読み手を鼓舞するような表現を使う
+                    9. #記号は絶対に使わない（見出しには「◆」「▼」「★」などを使う）
+                    10. ハッシュタグ（#〇〇）は一切使用しない
+                    
+                    音声メモが短い場合は、そのまま整理された形で出力してください。"""
+                },
+                {
+                    "role": "user", 
+                    "content": f"以下の音声メモを要約・整形してください：\n\n{text}"
+                }
+            ],
+            max_tokens=500,
+            temperature=0.3
+        )
+        
+        return summary
+        
+    except Exception as e:
+        print(f"ChatGPT要約でエラーが発生しました: {e}")
+        return f"要約処理中にエラーが発生しました。元のテキスト：\n{text}"
+
+
+def sns_messages(content):
+    """SNS投稿用変換のプロンプトを組み立てる関数"""
+    return [
+        {
+            "role": "system",
+            "content": f"""以下の文字起こしテキストを、X（旧Twitter）向けの短い要約に変換してください。
+
+**必須条件:**
+* **文字制限:** 最大{SNS_MAX_CHARS}文字（目標135文字）。厳守してください。
+* **構造:** 結論を冒頭に。PREP法を意識し、簡潔に理由や具体例を続けます。
+* **口調:** 親しみやすく、ポジティブな敬体・常体ミックス。上から目線なし。
+* **表現:** 過度な賛美や驚きの言葉は避け、気づきや学びを中心に記述。
+* **ハッシュタグ:** 使用禁止。
+
+文字数を厳密に守って、簡潔で価値のある投稿を作成してください。"""
+        },
+        {
+            "role": "user",
+            "content": f"**文字起こし:**\n{content}"
+        }
+    ]
+
+async def convert_to_sns_post(content):
+    """メモ内容をSNS投稿用に変換する関数"""
+    try:
+        sns_post = await cached_chat_completion(
+            "sns",
+            model=current_shard().chat_model,
+            messages=sns_messages(content),
+            max_tokens=200,
+            temperature=0.3
+        )
+        
+        return sns_post.strip()
+        
+    except Exception as e:
+        print(f"SNS変換でエラー: {e}")
+        return f"SNS変換に失敗しました。元の内容：\n{content[:100]}..."
+
+async def generate_sns_variants(content, n=REGENERATE_VARIANTS):
+    """1回のAPI呼び出しでSNS投稿の候補をn件生成する関数（文字数上限はローカルでも保証する）"""
+    response = await create_chat_completion(
+        kind="sns_variants",
+        model=current_shard().chat_model,
+        messages=sns_messages(content),
+        max_tokens=200,
+        temperature=REGENERATE_TEMPERATURE,
+        n=n,
+    )
+    within, trimmed = [], []
+    for choice in response.choices:
+        raw = (choice.message.content or "").strip()
+        text = fit_sns_length(raw)
+        if text and text not in within and text not in trimmed:
+            (within if text == raw else trimmed).append(text)
+    # 上限内に収まっていた候補を先に並べる
+    return within + trimmed
+
+def fit_sns_length(text, limit=SNS_MAX_CHARS):
+    """SNS投稿を文字数上限に収める関数（できるだけ文の切れ目で切る）"""
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    cut = max(head.rfind(mark) for mark in "。！？!?\n")
+    if cut >= limit // 2:
+        return head[:cut + 1].rstrip()
+    return head[:limit - 1] + "…"
@@ -0,0 +1,125 @@
+"""返信に付けるボタン"""
+import urllib.parse
+
+import discord
+
+from .config import DISCORD_MESSAGE_LIMIT
+from .progress import split_discord_message
+from .runtime import current_shard
+
+
+async def send_copy_text(interaction, text):
+    """ボタンを押した人だけに見えるメッセージでテキストを送る関数（長押しでコピーできる）
+
+    Botはサーバー上で動くため、押した人の端末のクリップボードには触れない。
+    """
+    chunks = split_discord_message(text, DISCORD_MESSAGE_LIMIT - len("```\n\n```")) or [""]
+    await interaction.response.send_message(f"```\n{chunks[0]}\n```", ephemeral=True)
+    for chunk in chunks[1:]:
+        await interaction.followup.send(f"```\n{chunk}\n```", ephemeral=True)
+
+# 複数テキストのコピーボタンとTwitter投稿ボタンをまとめたViewクラス
+class MemoResultView(discord.ui.View):
+    # 1つのViewに置けるボタンは25個まで（Twitterボタンの分を残す）
+    MAX_COPY_BUTTONS = 24
+
+    def __init__(self, copy_items):
+        super().__init__(timeout=600)  # 10分でタイムアウト
+        
+        for label, text in copy_items[:self.MAX_COPY_BUTTONS]:
+            self.add_item(CopyTextButton(label, text))
+        
+        # Twitter投稿ボタンを追加
+        twitter_button = discord.ui.Button(
+            label='🐦 Twitterで投稿',
+            style=discord.ButtonStyle.link,
+            url="https://twitter.com/intent/tweet",
+            emoji='🌐'
+        )
+        self.add_item(twitter_button)
+    
+    async def on_timeout(self):
+        """タイムアウト時の処理"""
+        for item in self.children:
+            item.disabled = True
+        
+        # メッセージを更新（可能であれば）
+        try:
+            await self.message.edit(view=self)
+        except:
+            pass
+
+class CopyTextButton(discord.ui.Button):
+    def __init__(self, label, text_content):
+        super().__init__(label=f'📋 {label}', style=discord.ButtonStyle.primary)
+        self.text_content = text_content
+    
+    async def callback(self, interaction: discord.Interaction):
+        """テキストコピーボタンが押されたときの処理"""
+        try:
+            await send_copy_text(interaction, self.text_content)
+        except Exception as e:
+            await interaction.response.send_message(f"❌ コピーエラー: {str(e)}", ephemeral=True)
+
+# 再生成したSNS投稿の候補を選ぶViewクラス
+class SnsVariantView(discord.ui.View):
+    def __init__(self, memo_id, variants):
+        super().__init__(timeout=600)  # 10分でタイムアウト
+        self.memo_id = memo_id
+        self.variants = variants
+        self.shard = current_shard()
+        
+        # 候補ボタンは4行まで（最後の行はTwitterボタン用）
+        for i in range(min(len(variants), 20)):
+            self.add_item(SnsVariantButton(i))
+        
+        # 選んだ案を入力済みにするTwitter投稿ボタン（最初は案1）
+        self.twitter_button = discord.ui.Button(
+            label='🐦 Twitterで投稿',
+            style=discord.ButtonStyle.link,
+            url=twitter_intent_url(variants[0]),
+            emoji='🌐',
+            row=4
+        )
+        self.add_item(self.twitter_button)
+    
+    async def select(self, interaction, index):
+        """候補が選ばれたときの処理"""
+        text = self.variants[index]
+        for item in self.children:
+            if isinstance(item, SnsVariantButton):
+                item.style = discord.ButtonStyle.success if item.index == index else discord.ButtonStyle.secondary
+        self.twitter_button.url = twitter_intent_url(text)
+        await interaction.response.edit_message(view=self)
+        await interaction.followup.send(f"✅ 案{index + 1}を選びました\n```\n{text}\n```", ephemeral=True)
+        try:
+            await self.shard.memo_journal.select_variant(self.memo_id, text)
+        except Exception as e:
+            print(f"ジャーナルへの記録でエラー: {e}")
+    
+    async def on_timeout(self):
+        """タイムアウト時の処理"""
+        for item in self.children:
+            item.disabled = True
+        
+        # メッセージを更新（可能であれば）
+        try:
+            await self.message.edit(view=self)
+        except:
+            pass
+
+class SnsVariantButton(discord.ui.Button):
+    def __init__(self, index):
+        super().__init__(label=f'案{index + 1}', style=discord.ButtonStyle.secondary, row=index // 5)
+        self.index = index
+    
+    async def callback(self, interaction: discord.Interaction):
+        """案のボタンが押されたときの処理"""
+        try:
+            await self.view.select(interaction, self.index)
+        except Exception as e:
+            await interaction.response.send_message(f"❌ 選択エラー: {str(e)}", ephemeral=True)
+
+def twitter_intent_url(text):
+    """本文を入力済みのTwitter投稿URLを作る関数"""
+    return f"https://twitter.com/intent/tweet?text={urllib.parse.quote(text)}"
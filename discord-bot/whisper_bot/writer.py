@@ -0,0 +1,187 @@
+"""Obsidianへのノート保存"""
+import asyncio
+import datetime
+import os
+import uuid
+
+from .config import NOTE_FSYNC_BATCH_WINDOW, NOTE_FSYNC_MODE
+from .runtime import current_shard, run_blocking
+
+
+class NoteWriter:
+    """Obsidianノートを書き込むクラス
+
+    書き込みはイベントループ外で行い、一時ファイルに書いてからリンクで
+    確定させるため、途中の状態のファイルが見えたり既存ノートを上書きしたりしない。
+    同じ秒に複数のノートが保存された場合は `_2`, `_3` ... の連番を付ける。
+    fsync_mode は none / each / batch（ディレクトリのfsyncを短い間隔でまとめる）。
+    """
+
+    def __init__(self, folder_path, index=None, fsync_mode=NOTE_FSYNC_MODE, batch_window=NOTE_FSYNC_BATCH_WINDOW,
+                 executor=None):
+        self.folder_path = folder_path
+        self.index = index
+        self.executor = executor
+        self.fsync_mode = fsync_mode
+        self.batch_window = batch_window
+        self._pending_sync = None
+
+    async def write(self, content, now, reuse_identical=False):
+        """ノートを保存し、保存したファイル名を返す
+
+        reuse_identicalなら、同じ日時の名前で同じ内容のノートが既にあれば書き込まずにそれを返す
+        （再開したジョブが同じノートを二重に作らないため）。
+        """
+        file_name = await run_blocking(self.executor, self._write, content, now, reuse_identical)
+        if self.fsync_mode == "batch":
+            await self._sync_directory_batched()
+        return file_name
+
+    def _write(self, content, now, reuse_identical=False):
+        os.makedirs(self.folder_path, exist_ok=True)
+        base_name = now.strftime("%Y%m%d_%H%M%S")
+        if reuse_identical:
+            existing = self._find_identical(base_name, content)
+            if existing is not None:
+                print(f"書き込み済みのノートを使います: {existing}")
+                return existing
+        tmp_path = os.path.join(self.folder_path, f".{base_name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+                if self.fsync_mode != "none":
+                    f.flush()
+                    os.fsync(f.fileno())
+            file_name, full_path = self._commit(tmp_path, base_name)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        if self.fsync_mode == "each":
+            self._fsync_directory()
+        # ノートインデックスに即時反映（再スキャン不要）
+        if self.index is not None:
+            self.index.update_note(file_name, content, full_path)
+        return file_name
+
+    def _find_identical(self, base_name, content):
+        """`base_name`, `base_name_2` ... のうち内容が同じノートのファイル名を返す"""
+        seq = 1
+        while True:
+            file_name = f"{base_name}.md" if seq == 1 else f"{base_name}_{seq}.md"
+            try:
+                with open(os.path.join(self.folder_path, file_name), 'r', encoding='utf-8') as f:
+                    if f.read() == content:
+                        return file_name
+            except FileNotFoundError:
+                return None
+            except OSError:
+                pass
+            seq += 1
+
+    def _commit(self, tmp_path, base_name):
+        """既存ファイルを上書きしない名前で一時ファイルを確定させる"""
+        seq = 1
+        while True:
+            file_name = f"{base_name}.md" if seq == 1 else f"{base_name}_{seq}.md"
+            full_path = os.path.join(self.folder_path, file_name)
+            try:
+                # リンクは既存ファイルがあれば失敗するので、名前の確保と確定を原子的に行える
+                os.link(tmp_path, full_path)
+                return file_name, full_path
+            except FileExistsError:
+                seq += 1
+            except OSError:
+                # ハードリンク非対応のファイルシステムでは排他作成で名前を確保してから置き換える
+                try:
+                    fd = os.open(full_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    seq += 1
+                    continue
+                os.close(fd)
+                os.replace(tmp_path, full_path)
+                return file_name, full_path
+
+    def _fsync_directory(self):
+        try:
+            fd = os.open(self.folder_path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    async def _sync_directory_batched(self):
+        """batch_window内に保存されたノートのディレクトリfsyncを1回にまとめる"""
+        if self._pending_sync is None:
+            self._pending_sync = asyncio.ensure_future(self._run_batched_sync())
+        await asyncio.shield(self._pending_sync)
+
+    async def _run_batched_sync(self):
+        await asyncio.sleep(self.batch_window)
+        # 以降に保存されたノートは次のバッチに回す
+        self._pending_sync = None
+        await run_blocking(self.executor, self._fsync_directory)
+
+
+class NoteSaveError(Exception):
+    """ノートを保存できなかったことを表す例外"""
+
+
+async def save_to_obsidian(raw_text, summarized_text=None, related_notes=None, sns_post=None, checkpoint=None):
+    """指定されたフォルダに、現在日時のファイル名でテキストを保存する関数
+
+    checkpointがあれば、書き込む前に日時と予定のファイル名を記録する。再開したジョブでは
+    記録した日時で同じ内容を組み立て、既に書き込み済みのノートがあればそれを使う。
+    """
+    try:
+        # 現在の日時を取得（再開したジョブでは記録済みの日時）
+        now = datetime.datetime.now()
+        resumed = False
+        note_writer = current_shard().note_writer
+        if checkpoint is not None:
+            plan = checkpoint.saved.get("save_plan")
+            if plan is None:
+                await checkpoint.store("save_plan", {
+                    "timestamp": now.isoformat(), "filename": f"{now.strftime('%Y%m%d_%H%M%S')}.md",
+                })
+            else:
+                now = datetime.datetime.fromisoformat(plan["timestamp"])
+                resumed = True
+        
+        # 書き込む内容をフォーマット
+        content_to_save = f"# 音声メモ {now.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        
+        if summarized_text:
+            content_to_save += f"## AI要約・整形\n\n{summarized_text}\n\n"
+        
+        # SNS投稿用テキストを追加
+        if sns_post:
+            content_to_save += f"## SNS投稿用\n\n{sns_post}\n\n"
+        
+        # 関連ノートのリンクを追加
+        if related_notes:
+            content_to_save += f"## 関連ノート\n\n"
+            for note in related_notes:
+                content_to_save += f"- [[{note}]]\n"
+            content_to_save += "\n"
+        
+        content_to_save += f"## 元の文字起こし\n\n{raw_text}\n"
+        
+        # YYYYMMDD_HHMMSS 形式のファイル名で保存（同じ秒なら連番を付ける）
+        file_name = await note_writer.write(content_to_save, now, reuse_identical=resumed)
+        print(f"Obsidianにノートを保存しました: {file_name}")
+        
+        if related_notes:
+            print(f"関連ノートリンク追加: {related_notes}")
+        if sns_post:
+            print(f"SNS投稿用テキスト追加完了")
+        
+        return file_name
+        
+    except Exception as e:
+        print(f"ファイルへの書き込み中にエラーが発生しました: {e}")
+        raise NoteSaveError(f"ノートを保存できませんでした: {e}") from e